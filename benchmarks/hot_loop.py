@@ -0,0 +1,156 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from src.decryption import decryption
+from src.encryption import encryption
+from src.utils import utils
+
+# Microbenchmark for the encrypt/decrypt hot loops. Run from the repository
+# root with ``python -m benchmarks.hot_loop``. Each variant is timed for
+# throughput, then run once more under tracemalloc for its peak traced
+# memory; "copies" is that peak divided by the file size, i.e. how many
+# whole-payload buffers were alive at once.
+#
+#   legacy    whole-file read, concatenated payload, padder and encryptor
+#             output, and salt + iv + ciphertext built for the write and
+#             the size check (the original engine)
+#   buffered  streaming engine writing through a BufferedWriter
+#   gathered  streaming engine writing through utils.OutputFile (os.writev)
+
+MASTER_KEY = os.urandom(32)
+KDF_SALT = os.urandom(16)
+
+
+def legacy_encrypt(input_path: str, out_path: str, name_header: bytes):
+    with open(input_path, "rb") as f:
+        data = f.read()
+    salt = os.urandom(16)
+    iv = os.urandom(16)
+    payload = name_header + data
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(payload) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(MASTER_KEY), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(padded) + encryptor.finalize()
+    with open(out_path + ".tmp", "wb") as f:
+        f.write(salt + iv + ciphertext)
+    if os.path.getsize(out_path + ".tmp") != len(salt + iv + ciphertext):
+        raise RuntimeError("size mismatch")
+    os.replace(out_path + ".tmp", out_path)
+
+
+def legacy_decrypt(enc_path: str, output_dir: str):
+    with open(enc_path, "rb") as f:
+        data = f.read()
+    iv, ciphertext = data[16:32], data[32:]
+    decryptor = Cipher(algorithms.AES(MASTER_KEY), modes.CBC(iv)).decryptor()
+    padded = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    payload = unpadder.update(padded) + unpadder.finalize()
+    name_length = int.from_bytes(payload[:2], "big")
+    file_data = payload[2 + name_length:]
+    with open(os.path.join(output_dir, "out.bin"), "wb") as f:
+        f.write(file_data)
+
+
+def stream_encrypt(cipher: str):
+    def run(input_path: str, out_path: str, name_header: bytes):
+        encryption._encrypt_to_path(MASTER_KEY, KDF_SALT, input_path, out_path, name_header, cipher)
+    return run
+
+
+def stream_decrypt(enc_path: str, output_dir: str):
+    os.remove(decryption._decrypt_to_directory("", enc_path, output_dir, "out.bin", MASTER_KEY))
+
+
+def _measure(func, paths: list, repeat: int) -> tuple:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for args in paths:
+            func(*args)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    for args in paths:
+        func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def _report(label: str, size: int, count: int, result: tuple):
+    seconds, peak = result
+    print(f"  {label:<14} {size * count / seconds / 2 ** 20:9.1f} MiB/s   "
+          f"peak {peak / 2 ** 20:8.2f} MiB   copies {peak / size:6.2f}")
+
+
+def run(workdir: str, size: int, count: int, repeat: int):
+    in_dir = os.path.join(workdir, "in")
+    out_dir = os.path.join(workdir, "out")
+    dec_dir = os.path.join(workdir, "dec")
+    for path in (in_dir, out_dir, dec_dir):
+        os.makedirs(path, exist_ok=True)
+
+    name_header = utils.build_name_header("sample.bin")
+    inputs = []
+    for i in range(count):
+        input_path = os.path.join(in_dir, f"{i}.bin")
+        with open(input_path, "wb") as f:
+            f.write(os.urandom(size))
+        inputs.append(input_path)
+    print(f"{count} file(s) of {size} bytes, best of {repeat}")
+
+    buffered_output = lambda path: open(path, "wb")
+    gathered_output = utils.OutputFile
+
+    encrypt_variants = [("legacy cbc", legacy_encrypt, None)]
+    for cipher in ("cbc", "gcm"):
+        encrypt_variants.append((f"buffered {cipher}", stream_encrypt(cipher), buffered_output))
+        encrypt_variants.append((f"gathered {cipher}", stream_encrypt(cipher), gathered_output))
+
+    print("encrypt")
+    for label, func, output in encrypt_variants:
+        if output is not None:
+            utils.OutputFile = output
+        paths = [(path, os.path.join(out_dir, f"{label.replace(' ', '_')}_{os.path.basename(path)}.dat"),
+                  name_header) for path in inputs]
+        try:
+            _report(label, size, count, _measure(func, paths, repeat))
+        finally:
+            utils.OutputFile = gathered_output
+
+    print("decrypt")
+    for label, func, output in [("legacy cbc", legacy_decrypt, None),
+                                ("buffered cbc", stream_decrypt, buffered_output),
+                                ("gathered cbc", stream_decrypt, gathered_output),
+                                ("buffered gcm", stream_decrypt, buffered_output),
+                                ("gathered gcm", stream_decrypt, gathered_output)]:
+        source = "legacy_cbc" if label.startswith("legacy") else label.replace("gathered", "buffered").replace(" ", "_")
+        paths = [(os.path.join(out_dir, f"{source}_{os.path.basename(path)}.dat"), dec_dir) for path in inputs]
+        if output is not None:
+            utils.OutputFile = output
+        try:
+            _report(label, size, count, _measure(func, paths, repeat))
+        finally:
+            utils.OutputFile = gathered_output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encrypt/decrypt hot loop microbenchmark")
+    parser.add_argument("--size", type=int, default=64 * 2 ** 20, help="bytes per file (default 64 MiB)")
+    parser.add_argument("--count", type=int, default=1, help="number of files")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per variant")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hot_loop_")
+    try:
+        run(workdir, args.size, args.count, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -1,11 +1,17 @@
+import io
 import os
 import shutil
+from datetime import datetime
 from typing import Optional, Tuple, Callable
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-from src.utils import utils
+from src.utils import container, utils
+from src.utils.compression import iter_decompressed
+from src.utils.pipeline import Pipeline, PipelineStats
+from src.utils.traversal import scan_files, scan_tree
 from src.utils.utils import derive_key
 
 
@@ -29,85 +35,898 @@ def _safe_progress_callback(callback: Optional[Callable], *args):
             pass
 
 
-def _validate_encrypted_file_structure(data: bytes) -> Tuple[bytes, bytes, bytes]:
-    if len(data) < 32:
-        raise FileCorruptionError("Encrypted file is too short or corrupted")
-
-    salt, iv, ciphertext = data[:16], data[16:32], data[32:]
-
-    if len(ciphertext) == 0:
+def _validate_ciphertext_length(ciphertext_length: int):
+    if ciphertext_length == 0:
         raise FileCorruptionError("No encrypted data found")
 
-    if len(ciphertext) % 16 != 0:
+    if ciphertext_length % 16 != 0:
         raise FileCorruptionError("Invalid ciphertext length (not aligned to block size)")
 
-    return salt, iv, ciphertext
 
+def _validate_encrypted_file_structure(header: bytes, file_size: int) -> Tuple[bytes, bytes, int]:
+    if len(header) < 32 or file_size < 32:
+        raise FileCorruptionError("Encrypted file is too short or corrupted")
 
-def decrypt_file(password: str, encrypted_filename: str):
-    if not password:
-        raise ValueError("Password cannot be empty")
+    salt, iv = header[:16], header[16:32]
+    ciphertext_length = file_size - 32
+    _validate_ciphertext_length(ciphertext_length)
 
-    if not encrypted_filename:
-        raise ValueError("Filename cannot be empty")
+    return salt, iv, ciphertext_length
 
-    enc_path = os.path.join("files", "encrypted", f"{encrypted_filename}.dat")
-    if not os.path.exists(enc_path):
-        raise FileNotFoundError(f"File '{encrypted_filename}.dat' not found")
 
+def _read_kdf_params(enc_path: str) -> Optional[Tuple[bytes, int, bool]]:
+    # Returns (salt, iterations, is container). Legacy files are keyed
+    # directly by PBKDF2 over their leading salt.
     try:
-        with open(enc_path, "rb") as f:
-            data = f.read()
+        with open(enc_path, "rb") as src:
+            header = container.read_header(src)
+            if header is None:
+                src.seek(0)
+                salt = src.read(16)
+                return (salt, utils.PBKDF2_ITERATIONS, False) if len(salt) == 16 else None
+    except (OSError, container.ContainerError):
+        return None
+    return header.kdf_salt, header.kdf_iterations, True
+
 
-        salt, iv, ciphertext = _validate_encrypted_file_structure(data)
+def _open_encrypted_file(src, file_size: int, password: str, master_key: Optional[bytes] = None):
+    # Returns (key, iv, ciphertext_length, header); header is None for legacy files.
+    try:
+        header = container.read_header(src)
+    except container.ContainerError as e:
+        raise FileCorruptionError(str(e))
+
+    if header is None:
+        src.seek(0)
+        salt, iv, ciphertext_length = _validate_encrypted_file_structure(src.read(32), file_size)
+        if master_key is None:
+            master_key = derive_key(password.encode(), salt)
+        return master_key, iv, ciphertext_length, None
+
+    ciphertext_length = file_size - src.tell()
+    if header.cipher == container.CIPHER_GCM:
+        try:
+            container.chunked_payload_length(ciphertext_length, header.chunk_size)
+        except container.ContainerError as e:
+            raise FileCorruptionError(str(e))
+    else:
+        _validate_ciphertext_length(ciphertext_length)
 
-        key = derive_key(password.encode(), salt)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-        decryptor = cipher.decryptor()
+    if master_key is None:
+        master_key = derive_key(password.encode(), header.kdf_salt, header.kdf_iterations)
+    if header.wrapped_key is not None:
+        key = utils.unwrap_file_key(master_key, header.nonce, header.wrapped_key)
+        if key is None:
+            raise InvalidPasswordError("Decryption failed - incorrect password")
+    else:
+        key = utils.derive_file_key(master_key, header.nonce)
+
+    # Headers with a key check reject a wrong password before any ciphertext is read.
+    if header.key_check is not None and not utils.verify_key_check(key, header.key_check):
+        raise InvalidPasswordError("Decryption failed - incorrect password")
+
+    return key, header.iv, ciphertext_length, header
+
+
+def _iter_plaintext(src, key: bytes, iv: bytes, ciphertext_length: int, key_verified: bool = False):
+    # Yields views into a reused buffer; each one must be consumed before the
+    # next is requested. Only the final block is held back for unpadding.
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    buffer_size = utils.buffer_size(ciphertext_length)
+    in_buffer = bytearray(buffer_size)
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(buffer_size + utils.BLOCK_SIZE - 1)
+    out_view = memoryview(out_buffer)
+    last_block = bytearray()
+    boundary = ciphertext_length - utils.BLOCK_SIZE
+    position = 0
+    remaining = ciphertext_length
+
+    while remaining:
+        n = src.readinto(in_view[:min(buffer_size, remaining)])
+        if not n:
+            raise FileCorruptionError("Encrypted file is truncated")
+        remaining -= n
 
         try:
-            padded_plain_data = decryptor.update(ciphertext) + decryptor.finalize()
+            m = decryptor.update_into(in_view[:n], out_buffer)
         except Exception as e:
             raise FileCorruptionError(f"Decryption failed - file may be corrupted: {str(e)}")
 
-        unpadder = padding.PKCS7(128).unpadder()
-        try:
-            decrypted_payload = unpadder.update(padded_plain_data) + unpadder.finalize()
-        except ValueError:
-            raise InvalidPasswordError("Decryption failed - incorrect password")
+        keep = max(0, min(m, boundary - position))
+        if keep:
+            yield out_view[:keep]
+        last_block += out_view[keep:m]
+        position += m
+
+    try:
+        decryptor.finalize()
+    except Exception as e:
+        raise FileCorruptionError(f"Decryption failed - file may be corrupted: {str(e)}")
 
-        name_from_payload, file_data = utils.extract_name_and_data_from_payload(decrypted_payload)
+    unpadder = padding.PKCS7(128).unpadder()
+    try:
+        tail = unpadder.update(bytes(last_block)) + unpadder.finalize()
+    except ValueError:
+        if key_verified:
+            raise FileCorruptionError("Decryption failed - invalid padding")
+        raise InvalidPasswordError("Decryption failed - incorrect password")
+
+    if tail:
+        yield tail
+
+
+def _decrypt_chunk(key: bytes, iv: bytes, index: int, last: bool, record, out_buffer,
+                   key_verified: bool = False) -> int:
+    # ``record`` is one chunk's ciphertext followed by its GCM tag.
+    tag_offset = len(record) - container.GCM_TAG_SIZE
+    decryptor = Cipher(
+        algorithms.AES(key), modes.GCM(container.chunk_nonce(iv, index), bytes(record[tag_offset:]))
+    ).decryptor()
+    decryptor.authenticate_additional_data(container.chunk_aad(index, last))
+    n = decryptor.update_into(record[:tag_offset], out_buffer)
+    try:
+        decryptor.finalize()
+    except InvalidTag:
+        if key_verified:
+            raise FileCorruptionError(f"Authentication failed for chunk {index} - file is corrupted")
+        raise InvalidPasswordError("Decryption failed - incorrect password")
+    return n
+
+
+def _iter_plaintext_chunked(src, key: bytes, iv: bytes, ciphertext_length: int, chunk_size: int,
+                            key_verified: bool = False):
+    # Same contract as _iter_plaintext, for the chunked GCM body.
+    record_size = chunk_size + container.GCM_TAG_SIZE
+    in_buffer = bytearray(utils.buffer_size(ciphertext_length, record_size))
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(len(in_buffer) + utils.BLOCK_SIZE - 1)
+    out_view = memoryview(out_buffer)
+    count = -(-ciphertext_length // record_size)
+
+    for index in range(count):
+        length = min(record_size, ciphertext_length - index * record_size)
+        if utils.readinto_exact(src, in_view[:length]) != length:
+            raise FileCorruptionError("Encrypted file is truncated")
+        n = _decrypt_chunk(key, iv, index, index == count - 1, in_view[:length], out_buffer, key_verified)
+        yield out_view[:n]
+
+
+def _iter_decompressed(chunks, compression: int):
+    try:
+        yield from iter_decompressed(chunks, compression)
+    except container.ContainerError as e:
+        raise FileCorruptionError(str(e)) from e
 
-        if name_from_payload:
-            original_name = name_from_payload
+
+class EncryptedReader(io.RawIOBase):
+    # Read-only, seekable view of the plaintext of a chunked GCM container.
+    # Only the chunks covering the requested range are read and authenticated.
+    def __init__(self, path: str, password: str, master_key: Optional[bytes] = None):
+        super().__init__()
+        self._file = open(path, "rb")
+        try:
+            file_size = os.fstat(self._file.fileno()).st_size
+            key, iv, ciphertext_length, header = _open_encrypted_file(self._file, file_size, password, master_key)
+            if (header is None or header.cipher != container.CIPHER_GCM
+                    or header.compression != container.COMPRESSION_NONE):
+                raise DecryptionError("File format does not support random access")
+
+            self._key = key
+            self._iv = iv
+            self._key_verified = header.key_check is not None
+            self._body_offset = self._file.tell()
+            self._chunk_size = header.chunk_size
+            self._record_size = self._chunk_size + container.GCM_TAG_SIZE
+            payload_length = container.chunked_payload_length(ciphertext_length, self._chunk_size)
+            self._chunk_count = container.chunk_count(payload_length, self._chunk_size)
+            self._record = bytearray(self._record_size)
+            self._chunk = bytearray(self._chunk_size + utils.BLOCK_SIZE - 1)
+            self._chunk_index = None
+            self._chunk_length = 0
+
+            self.data_offset = 0
+            self.name = None
+            if header.has_embedded_name:
+                head = bytearray(min(payload_length, 2 + utils.MAX_NAME_LENGTH))
+                self._read_payload(0, memoryview(head))
+                self.name, self.data_offset = utils.read_name_header(head)
+                if not self.name:
+                    raise FileCorruptionError("Embedded file name is invalid")
+
+            self.size = payload_length - self.data_offset
+            self._position = 0
+        except Exception:
+            self._file.close()
+            raise
+
+    def _load_chunk(self, index: int):
+        if self._chunk_index == index:
+            return
+        self._file.seek(self._body_offset + index * self._record_size)
+        view = memoryview(self._record)
+        n = utils.readinto_exact(self._file, view)
+        if n <= container.GCM_TAG_SIZE or (n < self._record_size and index != self._chunk_count - 1):
+            raise FileCorruptionError("Encrypted file is truncated")
+        self._chunk_index = None
+        self._chunk_length = _decrypt_chunk(self._key, self._iv, index, index == self._chunk_count - 1,
+                                            view[:n], self._chunk, self._key_verified)
+        self._chunk_index = index
+
+    def _read_payload(self, offset: int, view) -> int:
+        total = 0
+        while total < len(view):
+            index, start = divmod(offset + total, self._chunk_size)
+            if index >= self._chunk_count:
+                break
+            self._load_chunk(index)
+            n = min(self._chunk_length - start, len(view) - total)
+            if n <= 0:
+                break
+            view[total:total + n] = memoryview(self._chunk)[start:start + n]
+            total += n
+        return total
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        view = view[:max(0, min(len(view), self.size - self._position))]
+        n = self._read_payload(self.data_offset + self._position, view)
+        self._position += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
         else:
-            original_name = encrypted_filename
-            file_data = decrypted_payload
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def _decrypt_chunk_range(key: bytes, iv: bytes, enc_path: str, body_offset: int, chunk_size: int, chunk_count: int,
+                         data_offset: int, temp_path: str, first: int, last: int, key_verified: bool) -> int:
+    # Worker for intra-file parallelism: decrypts chunks [first, last) and
+    # writes their plaintext at its final offset in the preallocated temp file.
+    record_size = chunk_size + container.GCM_TAG_SIZE
+    in_buffer = bytearray(record_size)
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(chunk_size + utils.BLOCK_SIZE - 1)
+    out_view = memoryview(out_buffer)
+
+    out_fd = os.open(temp_path, os.O_WRONLY)
+    try:
+        with open(enc_path, "rb") as src:
+            src.seek(body_offset + first * record_size)
+            for index in range(first, last):
+                n = utils.readinto_exact(src, in_view)
+                if n <= container.GCM_TAG_SIZE or (n < record_size and index != chunk_count - 1):
+                    raise FileCorruptionError("Encrypted file is truncated")
+                m = _decrypt_chunk(key, iv, index, index == chunk_count - 1, in_view[:n], out_buffer, key_verified)
+
+                start = index * chunk_size
+                skip = max(0, data_offset - start)
+                if skip < m:
+                    utils.pwrite_all(out_fd, out_view[skip:m], start + skip - data_offset)
+    finally:
+        os.close(out_fd)
+    return last - first
+
+
+def _is_parallel_candidate(enc_path: str) -> bool:
+    if not utils.HAS_PWRITE or os.path.getsize(enc_path) < utils.PARALLEL_FILE_THRESHOLD:
+        return False
+    try:
+        with open(enc_path, "rb") as src:
+            header = container.read_header(src)
+    except container.ContainerError:
+        return False
+    return (header is not None and header.cipher == container.CIPHER_GCM
+            and header.compression == container.COMPRESSION_NONE)
 
-        os.makedirs("files/decrypted", exist_ok=True)
 
-        out_path = os.path.join("files", "decrypted", original_name)
-        base, ext = os.path.splitext(out_path)
-        counter = 1
-        while os.path.exists(out_path):
-            out_path = f"{base}_{counter}{ext}"
-            counter += 1
+def _decrypt_to_directory_parallel(password: str, enc_path: str, output_dir: str, fallback_name: str,
+                                   workers: int, names: Optional[utils.NameRegistry] = None) -> str:
+    temp_path = os.path.join(output_dir, os.path.basename(enc_path) + ".tmp")
 
-        temp_path = out_path + ".tmp"
+    with EncryptedReader(enc_path, password) as reader:
         try:
-            with open(temp_path, "wb") as f:
-                f.write(file_data)
-
-            if os.path.getsize(temp_path) != len(file_data):
+            with open(temp_path, "wb") as dst:
+                utils.preallocate(dst.fileno(), reader.size)
+
+            ranges = [
+                (reader._key, reader._iv, enc_path, reader._body_offset, reader._chunk_size, reader._chunk_count,
+                 reader.data_offset, temp_path, first, min(first + utils.PARALLEL_RANGE_CHUNKS, reader._chunk_count),
+                 reader._key_verified)
+                for first in range(0, reader._chunk_count, utils.PARALLEL_RANGE_CHUNKS)
+            ]
+            for _, _, error in utils.run_tasks(_decrypt_chunk_range, ranges, workers):
+                if error is not None:
+                    raise error
+
+            if os.path.getsize(temp_path) != reader.size:
                 raise FileCorruptionError("Output file size mismatch")
 
-            os.rename(temp_path, out_path)
+            out_path = _move_to_unique_path(temp_path, output_dir, reader.name or fallback_name, names)
 
         except Exception as e:
             if os.path.exists(temp_path):
                 os.remove(temp_path)
             raise e
 
+    return out_path
+
+
+def _temp_output_path(output_dir: str, name: str) -> str:
+    # Several workers may write a file of the same name into one directory
+    # at once, so temp names get a random suffix.
+    return os.path.join(output_dir, f"{name}.{os.urandom(4).hex()}.tmp")
+
+
+def _move_to_unique_path(temp_path: str, output_dir: str, original_name: str,
+                         names: Optional[utils.NameRegistry] = None) -> str:
+    # The registry's O_EXCL placeholder makes claiming a name atomic, so
+    # concurrent runs that decrypt files with the same original name never
+    # overwrite each other.
+    base, ext = os.path.splitext(original_name)
+    if names is None:
+        with utils.NameRegistry() as names:
+            out_path = names.claim(output_dir, base, ext)
+    else:
+        out_path = names.claim(output_dir, base, ext)
+    os.replace(temp_path, out_path)
+    return out_path
+
+
+def _split_plaintext(src, key: bytes, iv: bytes, ciphertext_length: int, header):
+    # Returns (embedded name, chunks of file data) for the body ``src`` is
+    # positioned at. The name header is decrypted and split off here; the
+    # chunks follow the _iter_plaintext contract.
+    if header is None:
+        read_name, peek = utils.split_name_header, utils.NAME_HEADER_PEEK
+    elif header.has_embedded_name:
+        read_name, peek = utils.read_name_header, 2 + utils.MAX_NAME_LENGTH
+    else:
+        read_name, peek = None, 0
+
+    key_verified = header is not None and header.key_check is not None
+
+    if header is not None and header.cipher == container.CIPHER_GCM:
+        chunks = _iter_plaintext_chunked(src, key, iv, ciphertext_length, header.chunk_size, key_verified)
+    else:
+        chunks = _iter_plaintext(src, key, iv, ciphertext_length, key_verified)
+    if header is not None and header.compression != container.COMPRESSION_NONE:
+        chunks = _iter_decompressed(chunks, header.compression)
+
+    head = bytearray()
+    for chunk in chunks:
+        if not head and len(chunk) >= peek:
+            head = chunk
+            break
+        head += chunk
+        if len(head) >= peek:
+            break
+
+    name, offset = read_name(head) if read_name else (None, 0)
+    if header is not None and header.has_embedded_name and not name:
+        raise FileCorruptionError("Embedded file name is invalid")
+
+    def data():
+        if len(head) > offset:
+            yield head[offset:]
+        yield from chunks
+
+    return name, data()
+
+
+def _decrypt_to_temp(password: str, enc_path: str, output_dir: str, master_key: Optional[bytes] = None,
+                     pipeline_depth: int = 0, pipeline_stats: Optional[PipelineStats] = None) -> Tuple[str, Optional[str]]:
+    # Decrypts into a temp file in ``output_dir`` and returns its path with
+    # the embedded name, if any; the caller moves it to its final name.
+    file_size = os.path.getsize(enc_path)
+    temp_path = _temp_output_path(output_dir, os.path.basename(enc_path))
+
+    with open(enc_path, "rb") as src:
+        key, iv, ciphertext_length, header = _open_encrypted_file(src, file_size, password, master_key)
+
+        try:
+            buffer_size = utils.buffer_size(ciphertext_length)
+            with utils.OutputFile(temp_path) as dst, Pipeline(src, dst, pipeline_depth, buffer_size) as stages:
+                name_from_payload, chunks = _split_plaintext(stages.reader, key, iv, ciphertext_length, header)
+                written = 0
+                for chunk in chunks:
+                    written += stages.writer.write(chunk)
+
+            if pipeline_stats is not None and pipeline_depth > 0:
+                pipeline_stats.merge(stages.stats.as_dict())
+
+            if os.path.getsize(temp_path) != written:
+                raise FileCorruptionError("Output file size mismatch")
+
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise e
+
+    return temp_path, name_from_payload
+
+
+def _decrypt_to_directory(password: str, enc_path: str, output_dir: str, fallback_name: str,
+                          master_key: Optional[bytes] = None, pipeline_depth: int = 0,
+                          pipeline_stats: Optional[PipelineStats] = None,
+                          names: Optional[utils.NameRegistry] = None) -> str:
+    temp_path, name_from_payload = _decrypt_to_temp(password, enc_path, output_dir, master_key, pipeline_depth,
+                                                    pipeline_stats)
+    return _place_outputs([(temp_path, output_dir, name_from_payload or fallback_name, None)], names)[0]
+
+
+def _peek_header(enc_path: str) -> Optional[container.ContainerHeader]:
+    with open(enc_path, "rb") as src:
+        return container.read_header(src)
+
+
+def _read_bundle_index(reader: EncryptedReader) -> list:
+    if reader.size < container.BUNDLE_TRAILER_SIZE:
+        raise FileCorruptionError("Bundle is truncated")
+    reader.seek(-container.BUNDLE_TRAILER_SIZE, io.SEEK_END)
+    index_length = int.from_bytes(reader.read(container.BUNDLE_TRAILER_SIZE), "big")
+    index_offset = reader.size - container.BUNDLE_TRAILER_SIZE - index_length
+    if index_offset < 0:
+        raise FileCorruptionError("Bundle index is truncated")
+    reader.seek(index_offset)
+    try:
+        members = container.unpack_bundle_index(reader.read(index_length))
+    except container.ContainerError as e:
+        raise FileCorruptionError(str(e)) from e
+    if any(member["offset"] + member["size"] > index_offset for member in members):
+        raise FileCorruptionError("Bundle member lies outside the bundle data")
+    return members
+
+
+def list_bundle_members(password: str, bundle_path: str, master_key: Optional[bytes] = None) -> list:
+    with EncryptedReader(bundle_path, password, master_key) as reader:
+        return _read_bundle_index(reader)
+
+
+def _place_outputs(outputs: list, names: Optional[utils.NameRegistry] = None) -> list:
+    # Moves (temp path, directory, name, mtime) outputs to unique final names
+    # and returns those; if one fails, the temps not yet moved are removed.
+    out_paths = []
+    for index, (temp_path, output_dir, name, mtime) in enumerate(outputs):
+        try:
+            out_path = _move_to_unique_path(temp_path, output_dir, name, names)
+        except Exception:
+            for leftover in outputs[index:]:
+                if os.path.exists(leftover[0]):
+                    os.remove(leftover[0])
+            raise
+        if isinstance(mtime, (int, float)):
+            os.utime(out_path, (mtime, mtime))
+        out_paths.append(out_path)
+    return out_paths
+
+
+def _is_member_selected(member_path: str, members: Optional[set], pattern: Optional[str],
+                        include: Optional[list], exclude: Optional[list], rel_dir: str = "") -> bool:
+    # ``pattern`` matches the path inside the bundle; include/exclude match
+    # it below the bundle's directory, like the paths of other files.
+    if members is not None and member_path not in members:
+        return False
+    if not utils.is_path_selected(member_path, [pattern] if pattern is not None else None):
+        return False
+    return utils.is_path_selected(f"{rel_dir}/{member_path}" if rel_dir else member_path, include, exclude)
+
+
+def _extract_bundle(password: str, bundle_path: str, output_dir: str, members: Optional[list] = None,
+                    master_key: Optional[bytes] = None, pattern: Optional[str] = None,
+                    include: Optional[list] = None, exclude: Optional[list] = None, rel_dir: str = "") -> list:
+    # Extracts the selected members (all of them by default) into temp files
+    # and returns them as _place_outputs expects. Only the chunks holding the
+    # index and the selected members are read and authenticated.
+    wanted = set(members) if members is not None else None
+    buffer = bytearray(utils.CHUNK_SIZE)
+    view = memoryview(buffer)
+    outputs = []
+
+    try:
+        with EncryptedReader(bundle_path, password, master_key) as reader:
+            for member in _read_bundle_index(reader):
+                if not _is_member_selected(member["path"], wanted, pattern, include, exclude, rel_dir):
+                    continue
+
+                parent, name = os.path.split(member["path"])
+                member_dir = os.path.join(output_dir, *parent.split("/")) if parent else output_dir
+                os.makedirs(member_dir, exist_ok=True)
+                temp_path = _temp_output_path(member_dir, name)
+                outputs.append((temp_path, member_dir, name, member.get("mtime")))
+
+                reader.seek(member["offset"])
+                remaining = member["size"]
+                with utils.OutputFile(temp_path) as dst:
+                    while remaining:
+                        n = reader.readinto(view[:min(remaining, len(buffer))])
+                        if not n:
+                            raise FileCorruptionError("Bundle is truncated")
+                        dst.write(view[:n])
+                        remaining -= n
+    except Exception as e:
+        for temp_path, _, _, _ in outputs:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise e
+
+    return outputs
+
+
+def decrypt_bundle(password: str, bundle_path: str, output_dir: str, members: Optional[list] = None,
+                   master_key: Optional[bytes] = None, pattern: Optional[str] = None,
+                   names: Optional[utils.NameRegistry] = None, include: Optional[list] = None,
+                   exclude: Optional[list] = None) -> int:
+    return len(_place_outputs(_extract_bundle(password, bundle_path, output_dir, members, master_key, pattern,
+                                              include, exclude), names))
+
+
+def _iter_reader_range(reader: EncryptedReader, start: int, stop: int):
+    buffer = bytearray(utils.buffer_size(stop - start))
+    view = memoryview(buffer)
+    reader.seek(start)
+    remaining = stop - start
+    while remaining:
+        n = reader.readinto(view[:min(remaining, len(buffer))])
+        if not n:
+            raise FileCorruptionError("Encrypted file is truncated")
+        yield view[:n]
+        remaining -= n
+
+
+class DecryptedStream:
+    # Plaintext of one encrypted file, decrypted while it is read so it is
+    # never written anywhere. Chunked GCM files without compression know
+    # their size up front and can be read from any offset; for other formats
+    # ``size`` is None and only the whole file can be read, once.
+    def __init__(self, password: str, enc_path: str, master_key: Optional[bytes] = None):
+        fallback_name = os.path.splitext(os.path.basename(enc_path))[0]
+        try:
+            header = _peek_header(enc_path)
+        except container.ContainerError as e:
+            raise FileCorruptionError(str(e))
+        if header is not None and header.is_bundle:
+            raise DecryptionError("Bundles hold several files")
+
+        self._reader = None
+        self._file = None
+        if (header is not None and header.cipher == container.CIPHER_GCM
+                and header.compression == container.COMPRESSION_NONE):
+            self._reader = EncryptedReader(enc_path, password, master_key)
+            self.name = self._reader.name or fallback_name
+            self.size = self._reader.size
+            return
+
+        self._file = open(enc_path, "rb", buffering=0)
+        try:
+            key, iv, ciphertext_length, header = _open_encrypted_file(
+                self._file, os.fstat(self._file.fileno()).st_size, password, master_key
+            )
+            name, self._chunks = _split_plaintext(self._file, key, iv, ciphertext_length, header)
+        except Exception:
+            self._file.close()
+            raise
+        self.name = name or fallback_name
+        self.size = None
+
+    @property
+    def seekable(self) -> bool:
+        return self._reader is not None
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None):
+        # Yields views into a reused buffer, like _iter_plaintext.
+        if self._reader is None:
+            if start or stop is not None:
+                raise DecryptionError("File format does not support random access")
+            return self._chunks
+        return _iter_reader_range(self._reader, start, self.size if stop is None else min(stop, self.size))
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_bundle(enc_path: str) -> bool:
+    try:
+        header = _peek_header(enc_path)
+    except container.ContainerError:
+        return False
+    return header is not None and header.is_bundle
+
+
+def open_decrypted(password: str, enc_path: str, key_cache: Optional[utils.KeyCache] = None,
+                   executor=None) -> DecryptedStream:
+    resolve_master_key = _master_key_resolver(password, key_cache, eager=True, executor=executor)
+    return DecryptedStream(password, enc_path, resolve_master_key(_read_kdf_params(enc_path)))
+
+
+def iter_decrypted_files(password: str, files, key_cache: Optional[utils.KeyCache] = None,
+                         on_error: Optional[Callable] = None, executor=None):
+    # Yields (archive path, mtime, size, chunks) for every file stored in the
+    # .dat files of ``files`` ((archive directory, path) pairs), bundles
+    # contributing their members, so a tree can be streamed out without
+    # decrypting it to disk. Each chunks iterator must be consumed before the
+    # next item is requested. Files that cannot be opened are passed to
+    # ``on_error`` with the error and skipped.
+    resolve_master_key = _master_key_resolver(password, key_cache, eager=True, executor=executor)
+    used_paths = set()
+
+    def unique_path(path: str) -> str:
+        base, ext = os.path.splitext(path)
+        candidate = path
+        counter = 1
+        while candidate in used_paths:
+            candidate = f"{base}_{counter}{ext}"
+            counter += 1
+        used_paths.add(candidate)
+        return candidate
+
+    for rel_dir, enc_path in files:
+        if not enc_path.lower().endswith(".dat"):
+            continue
+        prefix = rel_dir + "/" if rel_dir else ""
+
+        try:
+            master_key = resolve_master_key(_read_kdf_params(enc_path))
+            mtime = os.path.getmtime(enc_path)
+            if is_bundle(enc_path):
+                reader = EncryptedReader(enc_path, password, master_key)
+                try:
+                    members = _read_bundle_index(reader)
+                except Exception:
+                    reader.close()
+                    raise
+            else:
+                reader = DecryptedStream(password, enc_path, master_key)
+                members = None
+        except (DecryptionError, OSError) as e:
+            _safe_progress_callback(on_error, prefix + os.path.basename(enc_path), e)
+            continue
+
+        with reader:
+            if members is None:
+                yield unique_path(prefix + reader.name), mtime, reader.size, reader.iter_range()
+                continue
+            for member in members:
+                yield (unique_path(prefix + member["path"]), member.get("mtime", mtime), member["size"],
+                       _iter_reader_range(reader, member["offset"], member["offset"] + member["size"]))
+
+
+def _decrypt_task(password: str, enc_path: str, output_dir: str, fallback_name: str, master_key: Optional[bytes],
+                  pipeline_depth: int, members: Optional[list] = None, pattern: Optional[str] = None,
+                  include: Optional[list] = None, exclude: Optional[list] = None,
+                  rel_dir: str = "") -> Tuple[list, dict, Optional[bytes]]:
+    # Leaves the output in temp files; the caller claims the final names from
+    # its registry, so workers keep no per-run naming state.
+    master_key, derived_key = _task_master_key(password, enc_path, master_key)
+    stats = PipelineStats()
+    if is_bundle(enc_path):
+        return (_extract_bundle(password, enc_path, output_dir, members, master_key, pattern, include, exclude,
+                                rel_dir), stats.as_dict(), derived_key)
+    temp_path, name = _decrypt_to_temp(password, enc_path, output_dir, master_key, pipeline_depth, stats)
+    return [(temp_path, output_dir, name or fallback_name, None)], stats.as_dict(), derived_key
+
+
+def _task_master_key(password: str, enc_path: str,
+                     master_key: Optional[bytes]) -> Tuple[Optional[bytes], Optional[bytes]]:
+    # Returns (master key, key derived here). Keys that were not resolved up
+    # front - legacy files, one salt each - are derived in the worker and
+    # handed back, so the caller can still put them in its key cache.
+    if master_key is not None:
+        return master_key, None
+    kdf_params = _read_kdf_params(enc_path)
+    if kdf_params is None:
+        return None, None
+    master_key = derive_key(password.encode(), kdf_params[0], kdf_params[1])
+    return master_key, master_key
+
+
+def _cache_master_key(password: str, key_cache: Optional[utils.KeyCache], enc_path: str,
+                      master_key: Optional[bytes]):
+    if key_cache is None or master_key is None:
+        return
+    kdf_params = _read_kdf_params(enc_path)
+    if kdf_params is not None:
+        key_cache.put(key_cache.make_key(password.encode(), kdf_params[0], kdf_params[1]), master_key)
+
+
+def _master_key_resolver(password: str, key_cache: Optional[utils.KeyCache] = None, eager: bool = False,
+                         executor=None):
+    # Containers from one encrypt_directory run share a KDF salt, so their
+    # master key is derived once here, on the first file, and handed to the
+    # workers: one PBKDF2 run per batch. Legacy files have a salt of their
+    # own each; their key is left to the worker unless headers are read here
+    # (``eager``). A key cache is only consulted here: misses for legacy files
+    # still go to the workers, which return the key for _cache_master_key.
+    # Given an ``executor`` (a scheduler lane), PBKDF2 runs there, so it
+    # counts against the session's share of the pool.
+    master_keys = {}
+
+    def derive(salt, iterations):
+        if executor is None:
+            key = derive_key(password.encode(), salt, iterations)
+        else:
+            key = executor.submit(derive_key, password.encode(), salt, iterations).result()
+        if key_cache is not None:
+            key_cache.put(key_cache.make_key(password.encode(), salt, iterations), key)
+        return key
+
+    def resolve_master_key(kdf_params):
+        if kdf_params is None:
+            return None
+        salt, iterations, is_container = kdf_params
+        if (salt, iterations) in master_keys:
+            return master_keys[(salt, iterations)]
+        if key_cache is not None:
+            key = key_cache.get(key_cache.make_key(password.encode(), salt, iterations))
+            if key is not None:
+                master_keys[(salt, iterations)] = key
+                return key
+        if not is_container and not eager:
+            return None
+        master_keys[(salt, iterations)] = derive(salt, iterations)
+        return master_keys[(salt, iterations)]
+
+    return resolve_master_key
+
+
+def _read_entries(password: str, enc_path: str, fallback_name: str, master_key: Optional[bytes] = None) -> list:
+    # Describes an encrypted file, or every member of a bundle, using only the
+    # header metadata or the bundle index; file data is never decrypted.
+    # ``checked`` tells whether the password was confirmed on the way: legacy
+    # files carry nothing to check it against without decrypting them.
+    with open(enc_path, "rb") as src:
+        key, iv, ciphertext_length, header = _open_encrypted_file(src, os.fstat(src.fileno()).st_size, password,
+                                                                  master_key)
+    checked = header is not None and (header.wrapped_key is not None or header.key_check is not None)
+
+    if header is not None and header.is_bundle:
+        with EncryptedReader(enc_path, password, master_key) as reader:
+            return [
+                {"name": member["path"], "size": member["size"], "mtime": member.get("mtime"), "bundle": True,
+                 "checked": checked}
+                for member in _read_bundle_index(reader)
+            ]
+
+    metadata = None
+    if header is not None and header.metadata is not None:
+        metadata = utils.open_metadata(key, header.metadata)
+        if metadata is None:
+            raise FileCorruptionError("File metadata is corrupted")
+    if metadata is None:
+        # Older files carry no metadata; an embedded name stays unknown.
+        name = None if header is not None and header.has_embedded_name else fallback_name
+        return [{"name": name, "size": None, "mtime": None, "bundle": False, "checked": checked}]
+    # Sealed metadata only opens under the right key.
+    return [{"name": metadata.get("name"), "size": metadata.get("size"), "mtime": metadata.get("mtime"),
+             "bundle": False, "checked": True}]
+
+
+def _read_entries_task(password: str, enc_path: str, fallback_name: str,
+                       master_key: Optional[bytes]) -> Tuple[list, Optional[bytes]]:
+    master_key, derived_key = _task_master_key(password, enc_path, master_key)
+    return _read_entries(password, enc_path, fallback_name, master_key), derived_key
+
+
+def list_directory(password: str, mode: int, sessionID: str = None, key_cache: Optional[utils.KeyCache] = None,
+                   workers: int = 1, executor=None):
+    if not password:
+        raise ValueError("Password cannot be empty")
+
+    if mode == 0:
+        if not os.path.exists("files/encrypted/"):
+            raise FileNotFoundError("'files/encrypted/' not found")
+        root_in = os.path.join("files", "encrypted")
+    elif mode == 1:
+        if not sessionID:
+            raise ValueError("Session ID required for web mode")
+        root_in = os.path.join("files", "web", "uploads", sessionID)
+        if not os.path.exists(root_in):
+            raise FileNotFoundError(f"Upload directory not found for session {sessionID}")
+    else:
+        raise ValueError(f"Invalid mode: {mode}")
+
+    files = [(rel_path, file_entry) for _, rel_path, file_entry in scan_files(root_in)
+             if file_entry.name.lower().endswith('.dat')]
+    rel_paths = {file_entry.path: rel_path for rel_path, file_entry in files}
+
+    password_errors = 0
+    other_errors = []
+    listed = {}
+    resolve_master_key = _master_key_resolver(password, key_cache, executor=executor)
+    tasks = ((password, file_entry.path, os.path.splitext(file_entry.name)[0],
+              resolve_master_key(_read_kdf_params(file_entry.path))) for _, file_entry in files)
+
+    for task, result, error in utils.run_tasks(_read_entries_task, tasks, workers, executor):
+        rel_path = rel_paths[task[1]]
+        if error is None:
+            result, derived_key = result
+            _cache_master_key(password, key_cache, task[1], derived_key)
+            listed[rel_path] = [{"file": rel_path, **entry} for entry in result]
+        elif isinstance(error, InvalidPasswordError):
+            password_errors += 1
+        elif isinstance(error, (DecryptionError, OSError)):
+            other_errors.append(f"{rel_path}: {str(error)}")
+        else:
+            raise error
+
+    entries = [entry for rel_path, _ in files for entry in listed.get(rel_path, ())]
+
+    if mode == 0:
+        if not entries:
+            print("No files with that password found.\n")
+        for entry in entries:
+            size = "?" if entry["size"] is None else str(entry["size"])
+            mtime = "?" if entry["mtime"] is None else datetime.fromtimestamp(entry["mtime"]).strftime("%Y-%m-%d %H:%M:%S")
+            name = entry["name"] or "(encrypted name)"
+            note = "" if entry["checked"] else "  (legacy, not checked)"
+            print(f"{size:>12}  {mtime:<19}  {name}  [{entry['file']}]{note}")
+        unchecked = sum(1 for entry in entries if not entry["checked"])
+        if unchecked > 0:
+            print(f"Warning: the password was not checked for {unchecked} legacy files")
+        if password_errors > 0:
+            print(f"Warning: {password_errors} files skipped due to wrong password")
+        for error in other_errors[:5]:
+            print(f"  - {error}")
+        print()
+        return None
+    elif mode == 1:
+        return entries, password_errors, other_errors
+    return None
+
+
+def decrypt_file(password: str, encrypted_filename: str, workers: int = 1):
+    if not password:
+        raise ValueError("Password cannot be empty")
+
+    if not encrypted_filename:
+        raise ValueError("Filename cannot be empty")
+
+    enc_path = os.path.join("files", "encrypted", f"{encrypted_filename}.dat")
+    if not os.path.exists(enc_path):
+        raise FileNotFoundError(f"File '{encrypted_filename}.dat' not found")
+
+    try:
+        os.makedirs("files/decrypted", exist_ok=True)
+
+        output_dir = os.path.join("files", "decrypted")
+        if workers > 1 and _is_parallel_candidate(enc_path):
+            out_path = _decrypt_to_directory_parallel(password, enc_path, output_dir, encrypted_filename, workers)
+        else:
+            out_path = _decrypt_to_directory(password, enc_path, output_dir, encrypted_filename)
+
         print(f"File decrypted and saved to '{out_path}'.\n")
 
     except (OSError, IOError) as e:
@@ -121,7 +940,132 @@ def decrypt_file(password: str, encrypted_filename: str):
         raise DecryptionError("Insufficient memory for decryption") from e
 
 
-def decrypt_directory(password: str, mode: int, sessionID: str = None, progress_callback=None):
+def _verify_file(password: str, enc_path: str, master_key: Optional[bytes] = None) -> int:
+    # Runs every check decryption runs - structure, password, padding or
+    # chunk tags, decompression and the embedded name - but discards the
+    # plaintext instead of writing it. Returns the number of payload bytes.
+    header = _peek_header(enc_path)
+
+    if header is not None and header.is_bundle:
+        buffer = bytearray(utils.CHUNK_SIZE)
+        with EncryptedReader(enc_path, password, master_key) as reader:
+            verified = 0
+            while True:
+                n = reader.readinto(buffer)
+                if not n:
+                    break
+                verified += n
+            _read_bundle_index(reader)
+        return verified
+
+    file_size = os.path.getsize(enc_path)
+    with open(enc_path, "rb") as src:
+        key, iv, ciphertext_length, header = _open_encrypted_file(src, file_size, password, master_key)
+        key_verified = header is not None and header.key_check is not None
+
+        if header is not None and header.cipher == container.CIPHER_GCM:
+            chunks = _iter_plaintext_chunked(src, key, iv, ciphertext_length, header.chunk_size, key_verified)
+        else:
+            chunks = _iter_plaintext(src, key, iv, ciphertext_length, key_verified)
+        if header is not None and header.compression != container.COMPRESSION_NONE:
+            chunks = _iter_decompressed(chunks, header.compression)
+
+        peek = 2 + utils.MAX_NAME_LENGTH if header is not None and header.has_embedded_name else 0
+        head = bytearray()
+        verified = 0
+        for chunk in chunks:
+            if len(head) < peek:
+                head += chunk[:peek - len(head)]
+            verified += len(chunk)
+
+    if peek and not utils.read_name_header(head)[0]:
+        raise FileCorruptionError("Embedded file name is invalid")
+    return verified
+
+
+def _verify_task(password: str, enc_path: str, master_key: Optional[bytes]) -> Tuple[int, Optional[bytes]]:
+    master_key, derived_key = _task_master_key(password, enc_path, master_key)
+    return _verify_file(password, enc_path, master_key), derived_key
+
+
+def verify_directory(password: str, mode: int, sessionID: str = None, progress_callback=None, workers: int = 1,
+                     key_cache: Optional[utils.KeyCache] = None, include: Optional[list] = None,
+                     exclude: Optional[list] = None, executor=None):
+    if not password:
+        raise ValueError("Password cannot be empty")
+
+    if mode == 0:
+        if not os.path.exists("files/encrypted/"):
+            raise FileNotFoundError("'files/encrypted/' not found")
+        root_in = os.path.join("files", "encrypted")
+    elif mode == 1:
+        if not sessionID:
+            raise ValueError("Session ID required for web mode")
+        root_in = os.path.join("files", "web", "uploads", sessionID)
+        if not os.path.exists(root_in):
+            raise FileNotFoundError(f"Upload directory not found for session {sessionID}")
+    else:
+        raise ValueError(f"Invalid mode: {mode}")
+
+    paths = [
+        entry.path
+        for _, rel_path, entry in scan_files(root_in)
+        if entry.name.lower().endswith('.dat') and utils.is_path_selected(rel_path, include, exclude)
+    ]
+
+    if not paths:
+        if mode == 0:
+            print("No encrypted files found to verify.\n")
+        return None
+
+    resolve_master_key = _master_key_resolver(password, key_cache, executor=executor)
+    tasks = ((password, enc_path, resolve_master_key(_read_kdf_params(enc_path))) for enc_path in paths)
+
+    report = []
+    for task, result, error in utils.run_tasks(_verify_task, tasks, workers, executor):
+        entry = {"file": os.path.relpath(task[1], root_in).replace(os.sep, "/")}
+        if error is None:
+            verified, derived_key = result
+            _cache_master_key(password, key_cache, task[1], derived_key)
+            entry.update(status="ok", bytes=verified)
+        elif isinstance(error, InvalidPasswordError):
+            entry.update(status="wrong_password", detail=str(error))
+        elif isinstance(error, FileCorruptionError):
+            entry.update(status="corrupted", detail=str(error))
+        else:
+            entry.update(status="error", detail=str(error))
+        report.append(entry)
+        _safe_progress_callback(
+            progress_callback,
+            int((len(report) / len(paths)) * 100),
+            f"Verified {entry['file']}",
+            len(report),
+            len(paths)
+        )
+
+    report.sort(key=lambda entry: entry["file"])
+
+    if mode == 0:
+        failures = [entry for entry in report if entry["status"] != "ok"]
+        for entry in failures[:10]:
+            print(f"  - {entry['file']}: {entry['status']} ({entry['detail']})")
+        if len(failures) > 10:
+            print(f"  ... and {len(failures) - 10} more")
+        if failures:
+            print(f"Warning: {len(failures)} of {len(report)} files failed verification.\n")
+        else:
+            print(f"All {len(report)} files verified successfully.\n")
+        return None
+    elif mode == 1:
+        return report
+    return None
+
+
+def decrypt_directory(password: str, mode: int, sessionID: str = None, progress_callback=None, workers: int = 1,
+                      key_cache: Optional[utils.KeyCache] = None, pipeline_depth: int = 0, stats_callback=None,
+                      members: Optional[list] = None, pattern: Optional[str] = None,
+                      include: Optional[list] = None, exclude: Optional[list] = None, cancel_event=None,
+                      executor=None):
     if not password:
         raise ValueError("Password cannot be empty")
 
@@ -144,15 +1088,6 @@ def decrypt_directory(password: str, mode: int, sessionID: str = None, progress_
     else:
         raise ValueError(f"Invalid mode: {mode}")
 
-    total_files_socket = sum(
-        len([f for f in files if os.path.isfile(os.path.join(root, f))])
-        for root, dirs, files in os.walk(root_in)
-    )
-    if total_files_socket == 0:
-        if mode == 0:
-            print("No files found to decrypt.\n")
-        return None
-
     total_files = 0
     total_encrypted_files = 0
     decrypted_files = 0
@@ -160,127 +1095,133 @@ def decrypt_directory(password: str, mode: int, sessionID: str = None, progress_
     corruption_errors = 0
     other_errors = []
 
-    def decrypt_in_directory(encrypted_dir: str, decrypted_dir: str):
-        nonlocal total_files, total_encrypted_files, decrypted_files, password_errors, corruption_errors, other_errors
-
-        os.makedirs(decrypted_dir, exist_ok=True)
-
-        try:
-            items = os.listdir(encrypted_dir)
-        except PermissionError:
-            other_errors.append(f"Permission denied: {encrypted_dir}")
-            return
-
-        for item in items:
-            encrypted_path = os.path.join(encrypted_dir, item)
-
-            if os.path.isfile(encrypted_path):
-                total_files += 1
-
-                if not item.lower().endswith('.dat'):
+    resolve_master_key = _master_key_resolver(password, key_cache, executor=executor)
+
+    def on_scan_error(error: OSError):
+        other_errors.append(f"Permission denied: {error.filename}")
+
+    def collect_tasks():
+        # One scandir pass. A .dat file is selected by its own path or by the
+        # original paths it holds: the name in its header metadata, or the
+        # member paths of a bundle, which are read without decrypting any
+        # file data. Legacy files hold no names, so they are selected by path
+        # alone and never opened here. The progress total only counts
+        # selected files, growing as they are discovered.
+        nonlocal total_files, total_encrypted_files, password_errors, corruption_errors
+
+        for rel_dir, rel_path, entry in scan_tree(root_in, on_scan_error):
+            if utils.is_cancelled(cancel_event):
+                return
+            try:
+                if entry.is_dir():
+                    os.makedirs(os.path.join(root_out, *rel_path.split("/")), exist_ok=True)
                     continue
-
-                total_encrypted_files += 1
-
-                try:
-                    if not os.access(encrypted_path, os.R_OK):
-                        other_errors.append(f"No read permission: {item}")
-                        continue
-
-                    try:
-                        with open(encrypted_path, "rb") as f:
-                            data = f.read()
-                    except MemoryError:
-                        other_errors.append(f"File too large: {item}")
-                        continue
-                    except (OSError, IOError) as e:
-                        other_errors.append(f"Read error {item}: {str(e)}")
-                        continue
-
-                    try:
-                        salt, iv, ciphertext = _validate_encrypted_file_structure(data)
-                    except FileCorruptionError:
-                        corruption_errors += 1
-                        if mode == 0:
-                            print(f"Skipping corrupted file: {item}")
-                        continue
-
-                    key = derive_key(password.encode(), salt)
-                    cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-                    decryptor = cipher.decryptor()
-
-                    try:
-                        padded_plain_data = decryptor.update(ciphertext) + decryptor.finalize()
-                    except Exception:
-                        corruption_errors += 1
-                        if mode == 0:
-                            print(f"Decryption failed for corrupted file: {item}")
-                        continue
-
-                    unpadder = padding.PKCS7(128).unpadder()
-                    try:
-                        decrypted_payload = unpadder.update(padded_plain_data) + unpadder.finalize()
-                    except ValueError:
-                        password_errors += 1
-                        continue
-
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+
+            item = entry.name
+            if not item.lower().endswith('.dat'):
+                if utils.is_path_selected(rel_path, include, exclude):
+                    total_files += 1
+                continue
+
+            if not utils.is_path_selected(rel_path, None, exclude):
+                continue
+            # Bundles selected by their own path keep all their members.
+            path_included = utils.is_path_selected(rel_path, include)
+            member_include = None if path_included else include
+
+            encrypted_path = entry.path
+            decrypted_dir = os.path.join(root_out, *rel_dir.split("/")) if rel_dir else root_out
+            fallback_name = os.path.splitext(item)[0]
+            kdf_params = _read_kdf_params(encrypted_path)
+            master_key = resolve_master_key(kdf_params)
+
+            if not path_included or pattern is not None or exclude:
+                if kdf_params is not None and not kdf_params[2]:
+                    entry_names = [fallback_name]
+                else:
                     try:
-                        name_from_payload, file_data = utils.extract_name_and_data_from_payload(decrypted_payload)
-                    except Exception as e:
-                        corruption_errors += 1
-                        if mode == 0:
-                            print(f"Failed to extract data from {item}: {str(e)}")
+                        entries = _read_entries(password, encrypted_path, fallback_name, master_key)
+                    except (DecryptionError, OSError) as e:
+                        total_files += 1
+                        total_encrypted_files += 1
+                        if isinstance(e, InvalidPasswordError):
+                            password_errors += 1
+                        elif isinstance(e, FileCorruptionError):
+                            corruption_errors += 1
+                        else:
+                            other_errors.append(f"Error reading {item}: {str(e)}")
                         continue
+                    entry_names = [entry["name"] for entry in entries]
+                if not any(name and _is_member_selected(name, None, pattern, member_include, exclude, rel_dir)
+                           for name in entry_names):
+                    continue
 
-                    if name_from_payload:
-                        original_name = name_from_payload
-                    else:
-                        original_name = os.path.splitext(item)[0]
-                        file_data = decrypted_payload
-
-                    out_file_path = os.path.join(decrypted_dir, original_name)
-                    base, ext = os.path.splitext(out_file_path)
-                    counter = 1
-                    while os.path.exists(out_file_path):
-                        out_file_path = f"{base}_{counter}{ext}"
-                        counter += 1
-
-                    temp_path = out_file_path + ".tmp"
-                    try:
-                        with open(temp_path, "wb") as f:
-                            f.write(file_data)
-
-                        if os.path.getsize(temp_path) != len(file_data):
-                            raise FileCorruptionError("Output file size mismatch")
-
-                        os.rename(temp_path, out_file_path)
-                        decrypted_files += 1
+            total_files += 1
+            total_encrypted_files += 1
+            yield (password, encrypted_path, decrypted_dir, fallback_name, master_key, pipeline_depth, members,
+                   pattern, member_include, exclude, rel_dir)
 
-                        _safe_progress_callback(
-                            progress_callback,
-                            int((decrypted_files / total_files_socket) * 100),
-                            f"Decrypted {item}",
-                            decrypted_files,
-                            total_files_socket
-                        )
+    pipeline_stats = PipelineStats()
 
-                    except Exception as e:
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                        other_errors.append(f"Write error {item}: {str(e)}")
+    # Output names come from one registry for the whole run, so each output
+    # directory is listed once instead of probed per collision.
+    with utils.NameRegistry() as names:
+        for task, result, error in utils.run_tasks(_decrypt_task, collect_tasks(), workers, executor):
+            item = os.path.basename(task[1])
 
+            if error is None:
+                outputs, stats, derived_key = result
+                _cache_master_key(password, key_cache, task[1], derived_key)
+                try:
+                    placed = _place_outputs(outputs, names)
                 except Exception as e:
-                    if mode == 0:
-                        print(f"Error decrypting {item}: {str(e)}")
-                    elif mode == 1:
-                        other_errors.append(f"Error decrypting {item}: {str(e)}")
-
-            elif os.path.isdir(encrypted_path):
-                sub_decrypted = os.path.join(decrypted_dir, item)
-                os.makedirs(sub_decrypted, exist_ok=True)
-                decrypt_in_directory(encrypted_path, sub_decrypted)
+                    error = e
+
+            if error is None:
+                pipeline_stats.merge(stats)
+                # Counted per .dat file, like total_files and the errors; a
+                # bundle counts once however many members it held.
+                decrypted_files += 1 if placed else 0
+                _safe_progress_callback(
+                    progress_callback,
+                    int((decrypted_files / total_files) * 100),
+                    f"Decrypted {item}",
+                    decrypted_files,
+                    total_files
+                )
+            elif isinstance(error, InvalidPasswordError):
+                password_errors += 1
+            elif isinstance(error, FileCorruptionError):
+                corruption_errors += 1
+                if mode == 0:
+                    print(f"Skipping corrupted file {item}: {str(error)}")
+            elif isinstance(error, MemoryError):
+                other_errors.append(f"File too large: {item}")
+            elif isinstance(error, PermissionError):
+                other_errors.append(f"No read permission: {item}")
+            elif isinstance(error, (OSError, IOError)):
+                other_errors.append(f"IO error {item}: {str(error)}")
+            elif mode == 0:
+                print(f"Error decrypting {item}: {str(error)}")
+            elif mode == 1:
+                other_errors.append(f"Error decrypting {item}: {str(error)}")
+
+    if utils.is_cancelled(cancel_event):
+        raise utils.OperationCancelledError(f"Decryption cancelled after {decrypted_files} files")
+
+    if total_files == 0:
+        if mode == 0:
+            print("No files found to decrypt.\n")
+        return None
 
-    decrypt_in_directory(root_in, root_out)
+    if pipeline_depth > 0:
+        _safe_progress_callback(stats_callback, pipeline_stats.as_dict())
+        if mode == 0:
+            print(pipeline_stats.summary())
 
     if mode == 0:
         if corruption_errors > 0:
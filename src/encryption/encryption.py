@@ -1,11 +1,16 @@
+import json
 import os
 import shutil
+import time
 from typing import Optional, Callable
 
-from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-from src.utils import utils
+from src.decryption.decryption import DecryptionError, EncryptedReader, InvalidPasswordError
+from src.utils import container, utils
+from src.utils.compression import CompressingReader, is_compressible
+from src.utils.pipeline import Pipeline, PipelineStats
+from src.utils.traversal import scan_tree
 from src.utils.utils import derive_key
 
 
@@ -39,10 +44,444 @@ def _check_disk_space(file_path: str, estimated_size: int):
         pass
 
 
-def encrypt_file(password: str, filename: str, encrypt_name: bool = False):
+def _encrypt_stream(src, dst, key: bytes, iv: bytes, prefix: bytes = b"",
+                    chunk_size: int = utils.CHUNK_SIZE) -> int:
+    # PKCS7 padding is appended after the last chunk, so the output matches
+    # padding and encrypting the whole payload in one go.
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    in_buffer = bytearray(chunk_size)
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(chunk_size + utils.BLOCK_SIZE - 1)
+    out_view = memoryview(out_buffer)
+    written = 0
+    plain_length = 0
+
+    def feed(data):
+        nonlocal written
+        n = encryptor.update_into(data, out_buffer)
+        if n:
+            dst.write(out_view[:n])
+            written += n
+
+    prefix_view = memoryview(prefix)
+    for start in range(0, len(prefix), chunk_size):
+        feed(prefix_view[start:start + chunk_size])
+    plain_length += len(prefix)
+
+    while True:
+        n = src.readinto(in_buffer)
+        if not n:
+            break
+        feed(in_view[:n])
+        plain_length += n
+
+    pad_length = utils.BLOCK_SIZE - plain_length % utils.BLOCK_SIZE
+    feed(bytes([pad_length]) * pad_length)
+
+    tail = encryptor.finalize()
+    if tail:
+        dst.write(tail)
+        written += len(tail)
+    return written
+
+
+def _read_payload_chunk(src, view, prefix: bytes, start: int) -> int:
+    # Fills ``view`` with payload bytes from offset ``start``: the name prefix
+    # first, then file data. ``src`` must be positioned at the matching offset.
+    filled = max(0, min(len(view), len(prefix) - start))
+    view[:filled] = prefix[start:start + filled]
+    return filled + utils.readinto_exact(src, view[filled:])
+
+
+def _encrypt_chunk(key: bytes, iv: bytes, index: int, last: bool, data, out_buffer) -> int:
+    # Writes ciphertext followed by the GCM tag into ``out_buffer``.
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(container.chunk_nonce(iv, index))).encryptor()
+    encryptor.authenticate_additional_data(container.chunk_aad(index, last))
+    n = encryptor.update_into(data, out_buffer)
+    encryptor.finalize()
+    out_buffer[n:n + container.GCM_TAG_SIZE] = encryptor.tag
+    return n + container.GCM_TAG_SIZE
+
+
+def _encrypt_stream_chunked(src, dst, key: bytes, iv: bytes, prefix: bytes, payload_length: int,
+                            chunk_size: int) -> int:
+    buffer_size = utils.buffer_size(payload_length, chunk_size)
+    in_buffer = bytearray(buffer_size)
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(buffer_size + utils.BLOCK_SIZE - 1 + container.GCM_TAG_SIZE)
+    out_view = memoryview(out_buffer)
+    count = container.chunk_count(payload_length, chunk_size)
+    written = 0
+
+    for index in range(count):
+        start = index * chunk_size
+        length = min(chunk_size, payload_length - start)
+        if _read_payload_chunk(src, in_view[:length], prefix, start) != length:
+            raise FileCorruptionError("Input file changed during encryption")
+
+        n = _encrypt_chunk(key, iv, index, index == count - 1, in_view[:length], out_buffer)
+        dst.write(out_view[:n])
+        written += n
+
+    if src.read(1):
+        raise FileCorruptionError("Input file changed during encryption")
+    return written
+
+
+def _encrypt_chunk_range(key: bytes, iv: bytes, input_path: str, temp_path: str, prefix: bytes,
+                         payload_length: int, chunk_size: int, body_offset: int, first: int, last: int) -> int:
+    # Worker for intra-file parallelism: encrypts chunks [first, last) and
+    # writes each record at its final offset in the preallocated temp file.
+    in_buffer = bytearray(chunk_size)
+    in_view = memoryview(in_buffer)
+    out_buffer = bytearray(chunk_size + utils.BLOCK_SIZE - 1 + container.GCM_TAG_SIZE)
+    out_view = memoryview(out_buffer)
+    count = container.chunk_count(payload_length, chunk_size)
+    record_size = chunk_size + container.GCM_TAG_SIZE
+
+    out_fd = os.open(temp_path, os.O_WRONLY)
+    try:
+        with open(input_path, "rb") as src:
+            src.seek(max(0, first * chunk_size - len(prefix)))
+            for index in range(first, last):
+                start = index * chunk_size
+                length = min(chunk_size, payload_length - start)
+                if _read_payload_chunk(src, in_view[:length], prefix, start) != length:
+                    raise FileCorruptionError("Input file changed during encryption")
+
+                n = _encrypt_chunk(key, iv, index, index == count - 1, in_view[:length], out_buffer)
+                utils.pwrite_all(out_fd, out_view[:n], body_offset + index * record_size)
+    finally:
+        os.close(out_fd)
+    return last - first
+
+
+class ChunkedWriter:
+    # Writes a chunked GCM body whose length is not known up front. One full
+    # chunk is held back so the final chunk can be flagged on close().
+    def __init__(self, dst, key: bytes, iv: bytes, chunk_size: int):
+        self._dst = dst
+        self._key = key
+        self._iv = iv
+        self._buffer = bytearray(chunk_size)
+        self._out_buffer = bytearray(chunk_size + utils.BLOCK_SIZE - 1 + container.GCM_TAG_SIZE)
+        self._filled = 0
+        self._index = 0
+        self.position = 0
+        self.written = 0
+
+    def _emit(self, last: bool):
+        n = _encrypt_chunk(self._key, self._iv, self._index, last, memoryview(self._buffer)[:self._filled],
+                           self._out_buffer)
+        self._dst.write(memoryview(self._out_buffer)[:n])
+        self.written += n
+        self._index += 1
+        self._filled = 0
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast("B")
+        offset = 0
+        while offset < len(view):
+            if self._filled == len(self._buffer):
+                self._emit(last=False)
+            n = min(len(view) - offset, len(self._buffer) - self._filled)
+            self._buffer[self._filled:self._filled + n] = view[offset:offset + n]
+            self._filled += n
+            offset += n
+        self.position += len(view)
+        return len(view)
+
+    def write_from(self, src) -> int:
+        # Reads ``src`` to the end straight into the chunk buffer, skipping
+        # the intermediate copy a read()/write() pair would need.
+        buffer = memoryview(self._buffer)
+        total = 0
+        while True:
+            if self._filled == len(self._buffer):
+                self._emit(last=False)
+            n = src.readinto(buffer[self._filled:])
+            if not n:
+                return total
+            self._filled += n
+            self.position += n
+            total += n
+
+    def close(self) -> int:
+        self._emit(last=True)
+        return self.written
+
+
+class CbcWriter:
+    # Push counterpart of _encrypt_stream for payloads that arrive in pieces;
+    # the PKCS7 padding is added on close().
+    def __init__(self, dst, key: bytes, iv: bytes, chunk_size: int = utils.CHUNK_SIZE):
+        self._dst = dst
+        self._encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        self._chunk_size = chunk_size
+        self._out_buffer = bytearray(chunk_size + utils.BLOCK_SIZE - 1)
+        self.position = 0
+        self.written = 0
+
+    def _feed(self, data):
+        n = self._encryptor.update_into(data, self._out_buffer)
+        if n:
+            self._dst.write(memoryview(self._out_buffer)[:n])
+            self.written += n
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast("B")
+        for start in range(0, len(view), self._chunk_size):
+            self._feed(view[start:start + self._chunk_size])
+        self.position += len(view)
+        return len(view)
+
+    def close(self) -> int:
+        pad_length = utils.BLOCK_SIZE - self.position % utils.BLOCK_SIZE
+        self._feed(bytes([pad_length]) * pad_length)
+        tail = self._encryptor.finalize()
+        if tail:
+            self._dst.write(tail)
+            self.written += len(tail)
+        return self.written
+
+
+def _file_metadata(input_path: str) -> dict:
+    st = os.stat(input_path)
+    return {"name": os.path.basename(input_path), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def _new_header(master_key: bytes, kdf_salt: bytes, name_header: bytes, cipher: str, bundle: bool = False,
+                compression: str = "none", metadata: Optional[dict] = None):
+    # Returns (data key, iv, chunk size, packed header) for a new container.
+    if cipher not in container.CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+    if compression not in container.COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    nonce = os.urandom(16)
+    iv = os.urandom(16)
+    flags = container.FLAG_EMBEDDED_NAME if name_header else 0
+    if bundle:
+        flags |= container.FLAG_BUNDLE
+    chunk_size = container.GCM_CHUNK_SIZE if cipher == "gcm" else 0
+    key = os.urandom(utils.DATA_KEY_SIZE)
+    sealed_metadata = utils.seal_metadata(key, metadata) if metadata is not None else None
+    if sealed_metadata is not None and len(sealed_metadata) > container.MAX_METADATA_SIZE:
+        sealed_metadata = None
+    header = container.ContainerHeader.create(
+        kdf_salt, utils.PBKDF2_ITERATIONS, nonce, iv, flags, key_check=utils.compute_key_check(key),
+        cipher=container.CIPHERS[cipher], chunk_size=chunk_size,
+        compression=container.COMPRESSIONS[compression],
+        wrapped_key=utils.wrap_file_key(master_key, nonce, key), metadata=sealed_metadata
+    ).pack()
+    return key, iv, chunk_size, header
+
+
+def _encrypt_to_path(master_key: bytes, kdf_salt: bytes, input_path: str, out_path: str,
+                     name_header: bytes = b"", cipher: str = "cbc", pipeline_depth: int = 0,
+                     pipeline_stats: Optional[PipelineStats] = None, compression: str = "none") -> int:
+    if compression != "none" and not is_compressible(input_path):
+        compression = "none"
+    key, iv, chunk_size, header = _new_header(master_key, kdf_salt, name_header, cipher, compression=compression,
+                                              metadata=_file_metadata(input_path))
+
+    temp_path = out_path + ".tmp"
+    try:
+        with open(input_path, "rb", buffering=0) as src, utils.OutputFile(temp_path) as dst:
+            dst.write(header)
+            payload_length = len(name_header) + os.fstat(src.fileno()).st_size
+            buffer_size = utils.buffer_size(payload_length)
+            with Pipeline(src, dst, pipeline_depth, buffer_size) as stages:
+                if compression != "none":
+                    # The compressed length is only known at the end, so the
+                    # chunked body is written through ChunkedWriter instead.
+                    reader = CompressingReader(stages.reader, container.COMPRESSIONS[compression], name_header)
+                    if cipher == "gcm":
+                        writer = ChunkedWriter(stages.writer, key, iv, chunk_size)
+                        writer.write_from(reader)
+                        body = writer.close()
+                    else:
+                        body = _encrypt_stream(reader, stages.writer, key, iv)
+                elif cipher == "gcm":
+                    body = _encrypt_stream_chunked(stages.reader, stages.writer, key, iv, name_header,
+                                                   payload_length, chunk_size)
+                else:
+                    body = _encrypt_stream(stages.reader, stages.writer, key, iv, name_header, buffer_size)
+            written = len(header) + body
+
+        if pipeline_stats is not None and pipeline_depth > 0:
+            pipeline_stats.merge(stages.stats.as_dict())
+
+        if os.path.getsize(temp_path) != written:
+            raise FileCorruptionError("Output file size mismatch")
+
+        os.replace(temp_path, out_path)
+
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+
+    return written
+
+
+def _encrypt_chunks_to_path(master_key: bytes, kdf_salt: bytes, chunks, out_path: str, name_header: bytes,
+                            cipher: str, metadata: dict) -> int:
+    # Encrypts a payload that arrives as an iterable of chunks, e.g. an
+    # upload being received, so the plaintext never touches the disk.
+    # Returns the number of file bytes; an empty file leaves no output.
+    key, iv, chunk_size, header = _new_header(master_key, kdf_salt, name_header, cipher, metadata=metadata)
+
+    temp_path = out_path + ".tmp"
+    try:
+        with utils.OutputFile(temp_path) as dst:
+            dst.write(header)
+            writer = ChunkedWriter(dst, key, iv, chunk_size) if cipher == "gcm" else CbcWriter(dst, key, iv)
+            writer.write(name_header)
+            for chunk in chunks:
+                writer.write(chunk)
+            size = writer.position - len(name_header)
+            written = len(header) + writer.close()
+
+        if size == 0:
+            os.remove(temp_path)
+            return 0
+
+        if os.path.getsize(temp_path) != written:
+            raise FileCorruptionError("Output file size mismatch")
+
+        os.replace(temp_path, out_path)
+
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+
+    return size
+
+
+def _encrypt_to_path_parallel(master_key: bytes, kdf_salt: bytes, input_path: str, out_path: str,
+                              name_header: bytes, workers: int) -> int:
+    key, iv, chunk_size, header = _new_header(master_key, kdf_salt, name_header, "gcm",
+                                              metadata=_file_metadata(input_path))
+    input_size = os.path.getsize(input_path)
+    payload_length = len(name_header) + input_size
+    count = container.chunk_count(payload_length, chunk_size)
+    written = len(header) + payload_length + count * container.GCM_TAG_SIZE
+
+    temp_path = out_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as dst:
+            dst.write(header)
+            utils.preallocate(dst.fileno(), written)
+
+        ranges = [
+            (key, iv, input_path, temp_path, name_header, payload_length, chunk_size, len(header),
+             first, min(first + utils.PARALLEL_RANGE_CHUNKS, count))
+            for first in range(0, count, utils.PARALLEL_RANGE_CHUNKS)
+        ]
+        for _, _, error in utils.run_tasks(_encrypt_chunk_range, ranges, workers):
+            if error is not None:
+                raise error
+
+        if os.path.getsize(input_path) != input_size:
+            raise FileCorruptionError("Input file changed during encryption")
+
+        if os.path.getsize(temp_path) != written:
+            raise FileCorruptionError("Output file size mismatch")
+
+        os.replace(temp_path, out_path)
+
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+
+    return written
+
+
+def _encrypt_bundle(master_key: bytes, kdf_salt: bytes, files, out_path: str, failed_files: list,
+                    on_member: Callable) -> int:
+    # Packs the scanned ``files`` into one chunked container with an
+    # encrypted index; members are streamed, so memory use stays bounded.
+    key, iv, chunk_size, header = _new_header(master_key, kdf_salt, b"", "gcm", bundle=True)
+    members = []
+
+    temp_path = out_path + ".tmp"
+    try:
+        with utils.OutputFile(temp_path) as dst:
+            dst.write(header)
+            writer = ChunkedWriter(dst, key, iv, chunk_size)
+
+            for rel_dir, rel_path, entry in files:
+                item = entry.name
+                if os.path.abspath(entry.path) == os.path.abspath(temp_path):
+                    continue
+
+                # Bytes of a member that fails half way stay in the body but
+                # are not referenced by the index.
+                offset = writer.position
+                try:
+                    _check_disk_space(out_path, entry.stat().st_size)
+                    with open(entry.path, "rb", buffering=0) as src:
+                        mtime = os.fstat(src.fileno()).st_mtime
+                        writer.write_from(src)
+                except (OSError, IOError) as e:
+                    failed_files.append(f"Read error {item}: {str(e)}")
+                    continue
+
+                members.append({
+                    "path": rel_path,
+                    "offset": offset,
+                    "size": writer.position - offset,
+                    "mtime": mtime,
+                })
+                on_member(item)
+
+            writer.write(container.pack_bundle_index(members))
+            written = len(header) + writer.close()
+
+        if os.path.getsize(temp_path) != written:
+            raise FileCorruptionError("Output file size mismatch")
+
+        os.replace(temp_path, out_path)
+
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+
+    return len(members)
+
+
+def _estimate_output_size(input_size: int, name_header: bytes, cipher: str) -> int:
+    payload_length = input_size + len(name_header)
+    if cipher == "gcm":
+        return payload_length + container.chunk_count(payload_length, container.GCM_CHUNK_SIZE) * 16 + 128
+    return payload_length + 128
+
+
+def _encrypt_task(master_key: bytes, kdf_salt: bytes, input_path: str, out_path: str, name_header: bytes,
+                  cipher: str, pipeline_depth: int, compression: str = "none") -> dict:
+    estimated_output_size = _estimate_output_size(os.path.getsize(input_path), name_header, cipher)
+    _check_disk_space(os.path.dirname(out_path), estimated_output_size)
+    stats = PipelineStats()
+    _encrypt_to_path(master_key, kdf_salt, input_path, out_path, name_header, cipher, pipeline_depth, stats,
+                     compression)
+    return stats.as_dict()
+
+
+def encrypt_file(password: str, filename: str, encrypt_name: bool = False, cipher: str = "cbc", workers: int = 1,
+                 compression: str = "none"):
     if not password:
         raise ValueError("Password cannot be empty")
 
+    if cipher not in container.CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+
+    if compression not in container.COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
     if not filename:
         raise ValueError("Filename cannot be empty")
 
@@ -51,55 +490,39 @@ def encrypt_file(password: str, filename: str, encrypt_name: bool = False):
         raise FileNotFoundError(f"File '{filename}' not found")
 
     try:
-        with open(input_path, "rb") as f:
-            data = f.read()
-
-        if len(data) == 0:
+        input_size = os.path.getsize(input_path)
+        if input_size == 0:
             raise FileCorruptionError("Input file is empty")
 
-        estimated_output_size = len(data) + len(filename.encode()) + 64
+        name_header = utils.build_name_header(filename) if encrypt_name else b""
+
+        estimated_output_size = _estimate_output_size(input_size, name_header, cipher)
         os.makedirs("files/encrypted", exist_ok=True)
         _check_disk_space("files/encrypted", estimated_output_size)
 
-        salt = os.urandom(16)
-        iv = os.urandom(16)
-        key = derive_key(password.encode(), salt)
-
-        if encrypt_name:
-            filename_bytes = filename.encode("utf-8")
-            if len(filename_bytes) > 65535:
-                raise ValueError("Filename too long for encryption")
-            payload = len(filename_bytes).to_bytes(2, "big") + filename_bytes + data
-        else:
-            payload = data
-
-        padder = padding.PKCS7(128).padder()
-        padded = padder.update(payload) + padder.finalize()
-
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-        encryptor = cipher.encryptor()
-        ciphertext = encryptor.update(padded) + encryptor.finalize()
+        kdf_salt = os.urandom(16)
+        master_key = derive_key(password.encode(), kdf_salt)
 
         if encrypt_name:
             timestamp_name = utils.format_timestamp_from_path(input_path)
-            out_path = utils.get_unique_output_path("files/encrypted", timestamp_name, ".dat")
+            with utils.NameRegistry() as names:
+                out_path = names.claim("files/encrypted", timestamp_name, ".dat")
         else:
             out_path = os.path.join("files", "encrypted", filename) + ".dat"
 
-        temp_path = out_path + ".tmp"
         try:
-            with open(temp_path, "wb") as f:
-                f.write(salt + iv + ciphertext)
-
-            if os.path.getsize(temp_path) != len(salt + iv + ciphertext):
-                raise FileCorruptionError("Output file size mismatch")
-
-            os.rename(temp_path, out_path)
-
-        except Exception as e:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise e
+            # CBC is inherently serial; only the chunked format can be split
+            # across workers, and only when chunk offsets are known before
+            # compressing.
+            if (cipher == "gcm" and compression == "none" and workers > 1
+                    and input_size >= utils.PARALLEL_FILE_THRESHOLD and utils.HAS_PWRITE):
+                _encrypt_to_path_parallel(master_key, kdf_salt, input_path, out_path, name_header, workers)
+            else:
+                _encrypt_to_path(master_key, kdf_salt, input_path, out_path, name_header, cipher,
+                                 compression=compression)
+        except Exception:
+            _discard_placeholder(out_path)
+            raise
 
         print(f"File encrypted and saved to '{out_path}'.\n")
 
@@ -114,15 +537,125 @@ def encrypt_file(password: str, filename: str, encrypt_name: bool = False):
         raise EncryptionError("Insufficient memory for encryption") from e
 
 
+def _load_manifest(password: str, manifest_path: str):
+    # Returns (master_key, kdf_salt, manifest), or None when there is no
+    # usable manifest and the caller has to start from scratch. A wrong
+    # password raises instead, so a typo never rebuilds the archive under it.
+    try:
+        with open(manifest_path, "rb") as src:
+            header = container.read_header(src)
+    except (OSError, container.ContainerError):
+        return None
+    if header is None or header.kdf_iterations != utils.PBKDF2_ITERATIONS:
+        return None
+
+    master_key = derive_key(password.encode(), header.kdf_salt)
+    try:
+        with EncryptedReader(manifest_path, password, master_key) as reader:
+            manifest = json.loads(reader.read().decode("utf-8"))
+    except InvalidPasswordError:
+        raise InvalidPasswordError("Incorrect password for the existing encrypted files")
+    except (DecryptionError, OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != utils.MANIFEST_VERSION:
+        return None
+    if not isinstance(manifest.get("files"), dict):
+        return None
+    return master_key, header.kdf_salt, manifest
+
+
+def _save_manifest(master_key: bytes, kdf_salt: bytes, manifest_path: str, manifest: dict):
+    key, iv, chunk_size, header = _new_header(master_key, kdf_salt, b"", "gcm")
+    temp_path = manifest_path + ".tmp"
+    try:
+        with utils.OutputFile(temp_path) as dst:
+            dst.write(header)
+            writer = ChunkedWriter(dst, key, iv, chunk_size)
+            writer.write(json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+            writer.close()
+        os.replace(temp_path, manifest_path)
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+
+
+def _remove_output(root_out: str, output: str):
+    out_path = os.path.join(root_out, *output.split("/"))
+    try:
+        os.remove(out_path)
+    except FileNotFoundError:
+        pass
+    parent = os.path.dirname(out_path)
+    while os.path.abspath(parent) != os.path.abspath(root_out):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def _output_identity(out_path: str) -> Optional[tuple]:
+    # (size, header nonce) of an output. The nonce is random per file and
+    # survives a rekey, so it tells which file is stored under a name.
+    try:
+        with open(out_path, "rb") as src:
+            header = container.read_header(src)
+            size = os.fstat(src.fileno()).st_size
+    except (OSError, container.ContainerError):
+        return None
+    return (size, header.nonce.hex()) if header is not None else None
+
+
+def _output_matches(root_out: str, record: dict) -> bool:
+    # A recorded output only counts while it is still the file that run
+    # wrote; anything else at that name belongs to someone else.
+    identity = _output_identity(os.path.join(root_out, *record["output"].split("/")))
+    return identity is not None and list(identity) == record.get("output_id")
+
+
+def _discard_placeholder(out_path: str):
+    # Claimed names start out as empty placeholders; a failed task must not
+    # leave one behind. Finished outputs are never empty.
+    try:
+        if os.path.getsize(out_path) == 0:
+            os.remove(out_path)
+    except OSError:
+        pass
+
+
+def _encrypt_changed_task(master_key: bytes, kdf_salt: bytes, input_path: str, out_path: str, name_header: bytes,
+                          cipher: str, pipeline_depth: int, compression: str, previous_hash: Optional[str]):
+    # Incremental runs: a file whose size and mtime changed is hashed first,
+    # and only re-encrypted if its content really differs.
+    digest = utils.hash_file(input_path)
+    if digest == previous_hash:
+        return digest, None
+    return digest, _encrypt_task(master_key, kdf_salt, input_path, out_path, name_header, cipher, pipeline_depth,
+                                 compression)
+
+
 def encrypt_directory(password: str, mode: int, encrypt_name: bool = False, sessionID: str = None,
-                      progress_callback=None):
+                      progress_callback=None, workers: int = 1, cipher: str = "cbc", pipeline_depth: int = 0,
+                      stats_callback=None, bundle: bool = False, compression: str = "none",
+                      incremental: bool = False, cancel_event=None, executor=None):
     if not password:
         raise ValueError("Password cannot be empty")
 
+    if bundle and incremental:
+        raise ValueError("Bundles cannot be updated incrementally")
+
+    if cipher not in container.CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+
+    if compression not in container.COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
     if mode == 0:
         if not os.path.exists("files/input/"):
             raise FileNotFoundError("'files/input/' not found")
-        shutil.rmtree(os.path.join("files", "encrypted"), ignore_errors=True)
+        if not incremental:
+            shutil.rmtree(os.path.join("files", "encrypted"), ignore_errors=True)
         os.makedirs("files/encrypted", exist_ok=True)
         root_in = os.path.join("files", "input")
         root_out = os.path.join("files", "encrypted")
@@ -139,123 +672,214 @@ def encrypt_directory(password: str, mode: int, encrypt_name: bool = False, sess
     else:
         raise ValueError(f"Invalid mode: {mode}")
 
-    total_files = sum(
-        len([f for f in files if os.path.isfile(os.path.join(root, f))])
-        for root, dirs, files in os.walk(root_in)
-    )
-
-    if total_files == 0:
-        if mode == 0:
-            print("No files found to encrypt.\n")
-        return 0, 0
-
     encrypted_files = 0
+    skipped_files = 0
+    discovered_files = 0
     failed_files = []
 
-    def encrypt_in_directory(input_dir: str, output_dir: str):
-        nonlocal encrypted_files, failed_files
-
+    # The manifest lives next to the output directory and maps each input's
+    # relative path to its size, mtime, content hash and output file (name,
+    # size and header nonce). It is encrypted under the batch master key,
+    # which later runs reuse, so an unchanged tree costs one PBKDF2 run in
+    # total and one header read per file.
+    manifest_path = root_out.rstrip(os.sep) + utils.MANIFEST_SUFFIX
+    if not incremental:
+        # A full run rewrites the outputs, so an old manifest no longer
+        # describes them.
         try:
-            items = os.listdir(input_dir)
-        except PermissionError:
-            failed_files.append(f"Permission denied: {input_dir}")
-            return
-
-        for item in items:
-            input_path = os.path.join(input_dir, item)
-
-            if os.path.isfile(input_path):
+            os.remove(manifest_path)
+        except FileNotFoundError:
+            pass
+    settings = {"encrypt_name": encrypt_name, "cipher": cipher, "compression": compression}
+    previous = _load_manifest(password, manifest_path) if incremental else None
+    if previous is not None and all(previous[2].get(k) == v for k, v in settings.items()):
+        master_key, kdf_salt, manifest = previous
+        records = manifest["files"]
+    else:
+        if incremental:
+            shutil.rmtree(root_out, ignore_errors=True)
+            os.makedirs(root_out, exist_ok=True)
+        # One PBKDF2 run for the whole batch; every file gets an HKDF subkey.
+        kdf_salt = os.urandom(16)
+        master_key = derive_key(password.encode(), kdf_salt)
+        records = {}
+    seen_paths = set()
+    claimed_paths = set()
+    pending = {}
+
+    def on_scan_error(error: OSError):
+        failed_files.append(f"Permission denied: {error.filename}")
+
+    def discover_files(mirror_dirs: bool):
+        # Files are yielded as the single scandir pass finds them, and the
+        # progress total grows with them instead of being counted up front.
+        nonlocal discovered_files
+        for scanned in scan_tree(root_in, on_scan_error):
+            # Cancelling stops new files from being dispatched; files that
+            # are already being encrypted are finished.
+            if utils.is_cancelled(cancel_event):
+                return
+            try:
+                if scanned.entry.is_dir():
+                    if mirror_dirs:
+                        os.makedirs(os.path.join(root_out, *scanned.rel_path.split("/")), exist_ok=True)
+                    continue
+                if not scanned.entry.is_file():
+                    continue
+            except OSError:
+                continue
+            discovered_files += 1
+            yield scanned
+
+    def collect_tasks():
+        nonlocal skipped_files
+
+        for rel_dir, rel_path, entry in discover_files(mirror_dirs=True):
+            item = entry.name
+            input_path = entry.path
+            output_dir = os.path.join(root_out, *rel_dir.split("/")) if rel_dir else root_out
+            record = records.get(rel_path)
+            if record and not _output_matches(root_out, record):
+                record = None
+
+            try:
+                st = entry.stat()
+            except (OSError, IOError) as e:
+                seen_paths.add(rel_path)
+                failed_files.append(f"Read error {item}: {str(e)}")
+                continue
+
+            if st.st_size == 0:
+                failed_files.append(f"Empty file skipped: {item}")
+                continue
+
+            seen_paths.add(rel_path)
+            if incremental and record and record["size"] == st.st_size and record["mtime_ns"] == st.st_mtime_ns:
+                skipped_files += 1
+                continue
+
+            # Output names are assigned here, in traversal order, so they
+            # stay deterministic no matter which worker finishes first.
+            if record:
+                name_header = utils.build_name_header(item) if encrypt_name else b""
+                out_path = os.path.join(root_out, *record["output"].split("/"))
+            elif encrypt_name:
                 try:
-                    if not os.access(input_path, os.R_OK):
-                        failed_files.append(f"No read permission: {item}")
-                        continue
-
-                    try:
-                        with open(input_path, "rb") as f:
-                            data = f.read()
-                    except MemoryError:
-                        failed_files.append(f"File too large: {item}")
-                        continue
-                    except (OSError, IOError) as e:
-                        failed_files.append(f"Read error {item}: {str(e)}")
-                        continue
-
-                    if len(data) == 0:
-                        failed_files.append(f"Empty file skipped: {item}")
-                        continue
-
-                    salt = os.urandom(16)
-                    iv = os.urandom(16)
-                    key = derive_key(password.encode(), salt)
-
-                    if encrypt_name:
-                        filename_bytes = item.encode("utf-8")
-                        if len(filename_bytes) > 65535:
-                            failed_files.append(f"Filename too long: {item}")
+                    name_header = utils.build_name_header(item)
+                except ValueError:
+                    failed_files.append(f"Filename too long: {item}")
+                    continue
+                timestamp_name = utils.format_timestamp(st.st_ctime)
+                out_path = names.claim(output_dir, timestamp_name, ".dat")
+                claimed_paths.add(out_path)
+            else:
+                name_header = b""
+                out_path = os.path.join(output_dir, item) + ".dat"
+
+            if incremental:
+                pending[input_path] = (rel_path, st.st_size, st.st_mtime_ns,
+                                       os.path.relpath(out_path, root_out).replace(os.sep, "/"))
+                previous_hash = record["sha256"] if record and record["size"] == st.st_size else None
+                yield (master_key, kdf_salt, input_path, out_path, name_header, cipher, pipeline_depth,
+                       compression, previous_hash)
+            else:
+                yield master_key, kdf_salt, input_path, out_path, name_header, cipher, pipeline_depth, compression
+
+    pipeline_stats = PipelineStats()
+
+    def on_bundle_member(item: str):
+        nonlocal encrypted_files
+        encrypted_files += 1
+        _safe_progress_callback(
+            progress_callback,
+            int((encrypted_files / discovered_files) * 100),
+            f"Bundled {item}",
+            encrypted_files,
+            discovered_files
+        )
+
+    # Output names are claimed from one registry for the whole run, so each
+    # output directory is listed once instead of probed per collision.
+    with utils.NameRegistry() as names:
+        try:
+            if bundle:
+                # Names and file data live inside the bundle, so encrypt_name
+                # and the per-file options do not apply; bundles always use
+                # the chunked format.
+                out_path = names.claim(root_out, "bundle", ".dat")
+                claimed_paths.add(out_path)
+                _encrypt_bundle(master_key, kdf_salt, discover_files(mirror_dirs=False), out_path,
+                                failed_files, on_bundle_member)
+                claimed_paths.discard(out_path)
+            else:
+                task_func = _encrypt_changed_task if incremental else _encrypt_task
+                for task, result, error in utils.run_tasks(task_func, collect_tasks(), workers, executor):
+                    item = os.path.basename(task[2])
+
+                    if error is None:
+                        claimed_paths.discard(task[3])
+                        if incremental:
+                            digest, result = result
+                            rel_path, size, mtime_ns, output = pending.pop(task[2])
+                            output_id = _output_identity(task[3])
+                            records[rel_path] = {"size": size, "mtime_ns": mtime_ns, "sha256": digest,
+                                                 "output": output,
+                                                 "output_id": list(output_id) if output_id else None}
+                        if result is None:
+                            skipped_files += 1
                             continue
-                        payload = len(filename_bytes).to_bytes(2, "big") + filename_bytes + data
-                    else:
-                        payload = data
-
-                    padder = padding.PKCS7(128).padder()
-                    padded = padder.update(payload) + padder.finalize()
-
-                    cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-                    encryptor = cipher.encryptor()
-                    ciphertext = encryptor.update(padded) + encryptor.finalize()
-
-                    if encrypt_name:
-                        timestamp_name = utils.format_timestamp_from_path(input_path)
-                        out_path = utils.get_unique_output_path(output_dir, timestamp_name, ".dat")
-                    else:
-                        out_path = os.path.join(output_dir, item) + ".dat"
-
-                    os.makedirs(output_dir, exist_ok=True)
-
-                    try:
-                        _check_disk_space(output_dir, len(salt + iv + ciphertext))
-                    except InsufficientSpaceError:
-                        raise
-
-                    temp_path = out_path + ".tmp"
-                    try:
-                        with open(temp_path, "wb") as f:
-                            f.write(salt + iv + ciphertext)
-
-                        if os.path.getsize(temp_path) != len(salt + iv + ciphertext):
-                            raise FileCorruptionError("Output file size mismatch")
-
-                        os.rename(temp_path, out_path)
+                        pipeline_stats.merge(result)
                         encrypted_files += 1
-
                         _safe_progress_callback(
                             progress_callback,
-                            int((encrypted_files / total_files) * 100),
+                            int((encrypted_files / discovered_files) * 100),
                             f"Encrypted {item}",
                             encrypted_files,
-                            total_files
+                            discovered_files
                         )
+                    elif isinstance(error, InsufficientSpaceError):
+                        raise error
+                    elif isinstance(error, MemoryError):
+                        failed_files.append(f"Memory error: {item}")
+                    elif isinstance(error, PermissionError):
+                        failed_files.append(f"No read permission: {item}")
+                    elif isinstance(error, (OSError, IOError)):
+                        failed_files.append(f"IO error {item}: {str(error)}")
+                    else:
+                        failed_files.append(f"Encryption error {item}: {str(error)}")
+        finally:
+            for out_path in claimed_paths:
+                _discard_placeholder(out_path)
 
-                    except Exception as e:
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                        raise e
-
-                except InsufficientSpaceError:
-                    raise
-                except MemoryError:
-                    failed_files.append(f"Memory error: {item}")
-                except (OSError, IOError) as e:
-                    failed_files.append(f"IO error {item}: {str(e)}")
-                except Exception as e:
-                    failed_files.append(f"Encryption error {item}: {str(e)}")
+    cancelled = utils.is_cancelled(cancel_event)
+    if discovered_files == 0 and not incremental and not cancelled:
+        if mode == 0:
+            print("No files found to encrypt.\n")
+        return 0, 0
 
-            elif os.path.isdir(input_path):
-                sub_out = os.path.join(output_dir, item)
-                os.makedirs(sub_out, exist_ok=True)
-                encrypt_in_directory(input_path, sub_out)
+    removed_files = 0
+    if incremental:
+        # A cancelled run did not see the whole tree, so nothing is removed,
+        # but the files it did encrypt are recorded.
+        if not cancelled:
+            for rel_path in [path for path in records if path not in seen_paths]:
+                record = records.pop(rel_path)
+                if _output_matches(root_out, record):
+                    _remove_output(root_out, record["output"])
+                    removed_files += 1
+        _save_manifest(master_key, kdf_salt, manifest_path,
+                       {"version": utils.MANIFEST_VERSION, **settings, "files": records})
+
+    if cancelled:
+        raise utils.OperationCancelledError(f"Encryption cancelled after {encrypted_files} files")
+
+    if pipeline_depth > 0:
+        _safe_progress_callback(stats_callback, pipeline_stats.as_dict())
+        if mode == 0:
+            print(pipeline_stats.summary())
 
-    encrypt_in_directory(root_in, root_out)
+    if incremental and mode == 0:
+        print(f"{skipped_files} unchanged files skipped, {removed_files} outputs of removed files deleted.")
 
     if failed_files and mode == 0:
         print(f"Warning: {len(failed_files)} files failed to encrypt:")
@@ -273,5 +897,80 @@ def encrypt_directory(password: str, mode: int, encrypt_name: bool = False, sess
             print(f"{encrypted_files} files encrypted and saved to '{root_out}'.\n")
         return None
     elif mode == 1:
-        return encrypted_files, total_files
-    return None
\ No newline at end of file
+        return encrypted_files, discovered_files
+    return None
+
+
+def encrypt_upload(password: str, sessionID: str, files, encrypt_name: bool = False, cipher: str = "cbc",
+                   progress_callback=None):
+    # Web mode only: encrypts uploaded files while they are received, so only
+    # ciphertext is written. ``files`` yields (relative path, chunk iterator)
+    # pairs in upload order; outputs are named the way encrypt_directory
+    # names them, below the session's output directory.
+    if not password:
+        raise ValueError("Password cannot be empty")
+
+    if cipher not in container.CIPHERS:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+
+    if not sessionID:
+        raise ValueError("Session ID required for web mode")
+
+    root_out = os.path.join("files", "web", "output", sessionID)
+    os.makedirs(root_out, exist_ok=True)
+
+    kdf_salt = os.urandom(16)
+    master_key = derive_key(password.encode(), kdf_salt)
+
+    encrypted_files = 0
+    received_files = 0
+    failed_files = []
+
+    with utils.NameRegistry() as names:
+        for filename, chunks in files:
+            received_files += 1
+            parts = [part for part in filename.replace("\\", "/").split("/") if part not in ("", ".")]
+            if not parts or ".." in parts:
+                failed_files.append(f"Invalid file path: {filename}")
+                continue
+            item = parts[-1]
+            output_dir = os.path.join(root_out, *parts[:-1])
+
+            try:
+                name_header = utils.build_name_header(item) if encrypt_name else b""
+            except ValueError:
+                failed_files.append(f"Filename too long: {item}")
+                continue
+
+            out_path = None
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+                if encrypt_name:
+                    out_path = names.claim(output_dir, utils.format_timestamp(time.time()), ".dat")
+                else:
+                    out_path = os.path.join(output_dir, item) + ".dat"
+
+                size = _encrypt_chunks_to_path(master_key, kdf_salt, chunks, out_path, name_header, cipher,
+                                               {"name": item, "mtime": time.time()})
+            except (OSError, IOError) as e:
+                if out_path is not None:
+                    _discard_placeholder(out_path)
+                if e.errno == 28:
+                    raise InsufficientSpaceError("Insufficient disk space") from e
+                failed_files.append(f"IO error {item}: {str(e)}")
+                continue
+            except Exception:
+                # A broken upload stream ends the whole request.
+                if out_path is not None:
+                    _discard_placeholder(out_path)
+                raise
+
+            if size == 0:
+                _discard_placeholder(out_path)
+                failed_files.append(f"Empty file skipped: {item}")
+                continue
+
+            encrypted_files += 1
+            _safe_progress_callback(progress_callback, f"Encrypted {item}", encrypted_files)
+
+    return encrypted_files, received_files, failed_files
@@ -1,24 +1,34 @@
-import io
 import os
 import shutil
-import zipfile
 import uuid
-from threading import Lock
+import time
+from threading import Lock, Thread
 from functools import wraps
 
-from flask import Flask, request, render_template, send_file, jsonify, make_response
+from flask import Flask, Response, request, render_template, send_file, jsonify, make_response
 from flask_socketio import SocketIO, emit, join_room
 
-from src.decryption.decryption import decrypt_directory
-from src.encryption.encryption import encrypt_directory
+from src.decryption.decryption import DecryptionError, InvalidPasswordError, decrypt_directory, is_bundle, \
+    iter_decrypted_files, list_directory, open_decrypted, verify_directory
+from src.encryption.encryption import InsufficientSpaceError, encrypt_directory, encrypt_upload
+from src.interface.backend.jobs import FINISHED_STATES, QUEUED, JobManager, JobStore
+from src.rekey.rekey import rekey_directory
+from src.utils.multipart import iter_multipart
+from src.utils.scheduler import BULK, INTERACTIVE, FairScheduler
+from src.utils.traversal import scan_files
 from src.utils.utils import create_upload_directory, save_file_with_structure, delete_file, delete_old_upload_dirs, \
-    clear_output_directory
+    clear_output_directory, KeyCache, OperationCancelledError
+from src.utils.zipstream import iter_zip, iter_zip_streams
 
 from werkzeug.utils import secure_filename
 
 active_sessions = set()
 session_lock = Lock()
 
+key_caches = {}
+key_cache_lock = Lock()
+KEY_CACHE_PURGE_INTERVAL = 60
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 WEB_DIR = os.path.join(BASE_DIR, 'src', 'interface', 'web')
 
@@ -27,6 +37,11 @@ app = Flask(__name__, template_folder=WEB_DIR, static_folder=WEB_DIR)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 SESSION_COOKIE_NAME = "sessionID"
+MAX_WORKERS = os.cpu_count() or 1
+MAX_PIPELINE_DEPTH = 16
+MAX_JOBS = 2
+# Global cap on crypto work items running at once across all sessions.
+MAX_CONCURRENCY = int(os.environ.get("FILE_ENCRYPTION_MAX_CONCURRENCY") or MAX_WORKERS)
 
 
 def get_or_create_session_id_from_request(req):
@@ -46,6 +61,22 @@ def require_session_cookie(f):
     return wrapper
 
 
+def parse_workers(value):
+    if value is None or value == '':
+        return 1
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError('Invalid workers count')
+    return min(int(value), MAX_WORKERS)
+
+
+def parse_pipeline_depth(value):
+    if value is None or value == '':
+        return 0
+    if not value.isdigit():
+        raise ValueError('Invalid pipeline depth')
+    return min(int(value), MAX_PIPELINE_DEPTH)
+
+
 def safe_add_active(session_id):
     with session_lock:
         if session_id in active_sessions:
@@ -60,6 +91,45 @@ def safe_remove_active(session_id):
             active_sessions.remove(session_id)
 
 
+def get_key_cache(session_id):
+    with key_cache_lock:
+        if session_id not in key_caches:
+            key_caches[session_id] = KeyCache()
+        return key_caches[session_id]
+
+
+def drop_key_cache(session_id):
+    with key_cache_lock:
+        key_cache = key_caches.pop(session_id, None)
+    if key_cache:
+        key_cache.clear()
+
+
+def purge_key_caches():
+    # Wipes expired keys from every cache and drops the caches of sessions
+    # whose directories are gone.
+    with key_cache_lock:
+        session_ids = list(key_caches)
+    for session_id in session_ids:
+        if not any(os.path.exists(os.path.join("files", "web", folder, session_id))
+                   for folder in ("uploads", "output")):
+            drop_key_cache(session_id)
+            continue
+        with key_cache_lock:
+            key_cache = key_caches.get(session_id)
+        if key_cache:
+            key_cache.purge_expired()
+
+
+def run_key_cache_purger():
+    while True:
+        time.sleep(KEY_CACHE_PURGE_INTERVAL)
+        try:
+            purge_key_caches()
+        except Exception as e:
+            print(f"Error purging key caches: {str(e)}")
+
+
 def emit_progress(session_id, event_name, payload):
     socketio.emit(event_name, payload)
 
@@ -159,6 +229,109 @@ def upload_file():
         safe_remove_active(session_id)
 
 
+@app.route('/upload-encrypted', methods=['POST'])
+@require_session_cookie
+def upload_encrypted(session_id):
+    # Encrypts the files while the upload is received; only ciphertext is
+    # written, straight to the output directory. The password and options
+    # must come before the files in the form.
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return {'error': 'Expected a multipart/form-data upload'}, 400
+
+    if not safe_add_active(session_id):
+        return {'error': 'Session is busy with another operation'}, 400
+
+    total_size = request.content_length or 0
+    received = 0
+    last_percent = -1
+
+    def counted(chunks):
+        nonlocal received, last_percent
+        for data in chunks:
+            received += len(data)
+            percent = int(received / total_size * 100) if total_size else 0
+            if percent != last_percent:
+                last_percent = percent
+                emit_progress(session_id, 'upload_progress', {
+                    "percent": percent,
+                    "info": "Encrypting upload",
+                    "current": received,
+                    "total": total_size
+                })
+            yield data
+
+    encrypted_files = 0
+    received_files = 0
+    try:
+        parts = iter_multipart(request.stream, boundary.encode('latin-1'))
+        fields = {}
+        first_file = None
+        for part in parts:
+            if part[1] is None:
+                fields[part[0]] = part[2]
+            else:
+                first_file = part
+                break
+
+        password = fields.get('password')
+        encrypt_names = fields.get('encryptNames', 'false')
+        cipher = fields.get('cipher') or 'cbc'
+        if not password:
+            return {'error': 'Missing password; it must be sent before the files'}, 400
+        if encrypt_names not in ('true', 'false'):
+            return {'error': 'Invalid encryptNames state'}, 400
+        if cipher not in ('cbc', 'gcm'):
+            return {'error': 'Invalid cipher'}, 400
+        if first_file is None:
+            return {'error': 'Missing uploaded files'}, 400
+
+        def uploaded_files():
+            part = first_file
+            while part is not None:
+                name, filename, chunks = part
+                if name == 'files' and filename:
+                    yield filename, counted(chunks)
+                part = next(parts, None)
+
+        emit_progress(session_id, 'operation_started', {"operation": "upload"})
+
+        encrypted_files, received_files, failed_files = encrypt_upload(
+            password, session_id, uploaded_files(), encrypt_names == 'true', cipher
+        )
+    except ValueError as e:
+        emit_progress(session_id, 'operation_error', {"error": f"Invalid upload: {str(e)}"})
+        return {'error': f'Invalid upload: {str(e)}'}, 400
+    except InsufficientSpaceError:
+        emit_progress(session_id, 'operation_error', {"error": "Insufficient disk space"})
+        return {'error': 'Insufficient disk space'}, 507
+    except OSError as e:
+        if e.errno == 28:
+            emit_progress(session_id, 'operation_error', {"error": "Insufficient disk space"})
+            return {'error': 'Insufficient disk space'}, 507
+        emit_progress(session_id, 'operation_error', {"error": f"File system error: {str(e)}"})
+        return {'error': f'File system error: {str(e)}'}, 500
+    except Exception as e:
+        emit_progress(session_id, 'operation_error', {"error": f"Encryption failed: {str(e)}"})
+        return {'error': f'Error encrypting upload: {str(e)}'}, 500
+    finally:
+        safe_remove_active(session_id)
+        emit_progress(session_id, 'operation_finished', {
+            'operation': 'upload',
+            "processed": encrypted_files,
+            "total": received_files
+        })
+
+    if encrypted_files == 0:
+        return {'error': 'No files were encrypted', 'errors': failed_files}, 400
+
+    response = {'message': f'{encrypted_files} file(s) encrypted on upload!'}
+    if failed_files:
+        response['status'] = 'warning'
+        response['errors'] = failed_files
+    return response, 200
+
+
 @app.route('/remove-folder', methods=['POST'])
 @require_session_cookie
 def remove_folder(session_id):
@@ -212,39 +385,39 @@ def remove_file(session_id):
     return {'message': 'File deleted successfully!'}
 
 
-@app.route('/encrypt-files', methods=['POST'])
-@require_session_cookie
-def encrypt_files(session_id):
-    password = request.form.get('password')
-    encrypt_names = request.form.get('encryptNames')
+def job_progress(job_id, session_id, event_name):
+    def callback(pct, info, cur, tot):
+        payload = {"percent": pct, "info": info, "current": cur, "total": tot}
+        job_manager.report_progress(job_id, payload)
+        emit_progress(session_id, event_name, {**payload, "job_id": job_id})
+    return callback
 
-    if not password or encrypt_names is None:
-        return {'error': 'Missing encrypt names boolean or password'}, 400
-
-    if encrypt_names == "true":
-        encrypt_names_bool = True
-    elif encrypt_names == "false":
-        encrypt_names_bool = False
-    else:
-        return {'error': 'Invalid encryptNames state'}, 400
-
-    if not safe_add_active(session_id):
-        return {'error': 'Session is busy with another operation'}, 400
 
+def run_encrypt_job(job_id, session_id, params, password, cancel_event):
     clear_output_directory(session_id)
 
     try:
-        emit_progress(session_id, 'operation_started', {"operation": "encrypt"})
+        emit_progress(session_id, 'operation_started', {"operation": "encrypt", "job_id": job_id})
 
         encrypted_files, total_files = encrypt_directory(
             password,
             1,
-            encrypt_names_bool,
+            params["encrypt_names"],
             sessionID=session_id,
-            progress_callback=lambda pct, info, cur, tot: emit_progress(
-                session_id, 'encrypt_progress', {"percent": pct, "info": info, "current": cur, "total": tot}
-            )
+            progress_callback=job_progress(job_id, session_id, 'encrypt_progress'),
+            workers=params["workers"],
+            cipher=params["cipher"],
+            pipeline_depth=params["pipeline_depth"],
+            stats_callback=lambda stats: emit_progress(session_id, 'pipeline_stats', stats),
+            bundle=params["bundle"],
+            compression=params["compression"],
+            cancel_event=cancel_event,
+            executor=scheduler.lane(session_id)
         )
+    except OperationCancelledError as e:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": str(e), "job_id": job_id})
+        raise
     except PermissionError as e:
         emit_progress(session_id, 'operation_error', {"error": "Permission denied accessing files"})
         return {'error': 'Permission denied accessing files'}, 500
@@ -263,43 +436,36 @@ def encrypt_files(session_id):
     except Exception as e:
         emit_progress(session_id, 'operation_error', {"error": f"Encryption failed: {str(e)}"})
         return {'error': f'Error encrypting files: {str(e)}'}, 500
-    finally:
-        safe_remove_active(session_id)
 
     if encrypted_files is None or encrypted_files == 0:
         emit_progress(session_id, 'operation_error', {"error": "No files were encrypted"})
         return {'error': 'No files found to encrypt'}, 400
     elif encrypted_files == 1:
         emit_progress(session_id, 'operation_finished', {'operation': 'encrypt', "processed": encrypted_files, "total": total_files})
-        return {'message': '1 File encrypted successfully!'}
+        return {'message': '1 File encrypted successfully!'}, 200
     else:
         emit_progress(session_id, 'operation_finished', {'operation': 'encrypt', "processed": encrypted_files, "total": total_files})
-        return {'message': f'{encrypted_files} files encrypted successfully!'}
+        return {'message': f'{encrypted_files} files encrypted successfully!'}, 200
 
 
-@app.route('/decrypt-files', methods=['POST'])
-@require_session_cookie
-def decrypt_files(session_id):
-    password = request.form.get('password')
-
-    if not password:
-        return {'error': 'Missing password'}, 400
-
-    if not safe_add_active(session_id):
-        return {'error': 'Session is busy with another operation'}, 400
+def run_decrypt_job(job_id, session_id, params, password, cancel_event):
+    key_cache = get_key_cache(session_id) if params["cache_keys"] else None
 
     clear_output_directory(session_id)
 
     total_files = 0
     decrypted_files = 0
     try:
-        emit_progress(session_id, 'operation_started', {'operation': 'decrypt'})
+        emit_progress(session_id, 'operation_started', {'operation': 'decrypt', "job_id": job_id})
 
         result = decrypt_directory(password, 1, session_id,
-                                   progress_callback=lambda pct, info, cur, tot: emit_progress(
-                                       session_id, 'decrypt_progress',
-                                       {"percent": pct, "info": info, "current": cur, "total": tot}
-                                   ))
+                                   progress_callback=job_progress(job_id, session_id, 'decrypt_progress'),
+                                   workers=params["workers"], key_cache=key_cache,
+                                   pipeline_depth=params["pipeline_depth"],
+                                   stats_callback=lambda stats: emit_progress(session_id, 'pipeline_stats', stats),
+                                   members=params["members"], pattern=params["pattern"],
+                                   include=params["include"], exclude=params["exclude"], cancel_event=cancel_event,
+                                   executor=scheduler.lane(session_id))
 
         if result is None:
             emit_progress(session_id, 'operation_error', {"error": "No files found to decrypt!"})
@@ -324,6 +490,9 @@ def decrypt_files(session_id):
             'message': f'{decrypted_files} file(s) decrypted successfully!'
         }
 
+        if key_cache:
+            response['key_cache'] = key_cache.stats()
+
         if total_encrypted_files != total_files or password_errors > 0:
             response['status'] = 'warning'
 
@@ -335,6 +504,10 @@ def decrypt_files(session_id):
                 response['warning_mismatch'] = f'{mismatch_count} unencrypted file(s)'
 
         return response, 200
+    except OperationCancelledError as e:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": str(e), "job_id": job_id})
+        raise
     except PermissionError:
         clear_output_directory(session_id)
         emit_progress(session_id, 'operation_error', {"error": "Permission denied accessing files"})
@@ -359,10 +532,325 @@ def decrypt_files(session_id):
         emit_progress(session_id, 'operation_error', {"error": f"Decryption failed: {str(e)}"})
         return {'error': f'Error decrypting file: {str(e)}'}, 500
     finally:
-        safe_remove_active(session_id)
         emit_progress(session_id, 'operation_finished', {'operation': 'decrypt', "processed": decrypted_files, "total": total_files})
 
 
+scheduler = None
+job_manager = None
+services_lock = Lock()
+
+
+def start_services():
+    # The scheduler and job store are only created when the web interface
+    # runs, so console mode never touches files/web.
+    global scheduler, job_manager
+    with services_lock:
+        if job_manager is None:
+            scheduler = FairScheduler(MAX_CONCURRENCY)
+            job_manager = JobManager(
+                JobStore(os.path.join("files", "web", "jobs.sqlite3"), os.path.join("files", "web", "jobs.key")),
+                {"encrypt": run_encrypt_job, "decrypt": run_decrypt_job},
+                MAX_JOBS,
+                safe_add_active,
+                safe_remove_active
+            )
+            Thread(target=run_key_cache_purger, name="key-cache-purger", daemon=True).start()
+    job_manager.start()
+
+
+@app.route('/encrypt-files', methods=['POST'])
+@require_session_cookie
+def encrypt_files(session_id):
+    password = request.form.get('password')
+    encrypt_names = request.form.get('encryptNames')
+
+    if not password or encrypt_names is None:
+        return {'error': 'Missing encrypt names boolean or password'}, 400
+
+    if encrypt_names == "true":
+        encrypt_names_bool = True
+    elif encrypt_names == "false":
+        encrypt_names_bool = False
+    else:
+        return {'error': 'Invalid encryptNames state'}, 400
+
+    try:
+        workers = parse_workers(request.form.get('workers'))
+        pipeline_depth = parse_pipeline_depth(request.form.get('pipelineDepth'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    cipher = request.form.get('cipher') or 'cbc'
+    if cipher not in ('cbc', 'gcm'):
+        return {'error': 'Invalid cipher'}, 400
+
+    compression = request.form.get('compression') or 'none'
+    if compression not in ('none', 'zlib', 'lzma'):
+        return {'error': 'Invalid compression'}, 400
+
+    bundle = request.form.get('bundle')
+    if bundle not in (None, 'true', 'false'):
+        return {'error': 'Invalid bundle state'}, 400
+
+    job_id = job_manager.submit(session_id, 'encrypt', {
+        "encrypt_names": encrypt_names_bool,
+        "workers": workers,
+        "pipeline_depth": pipeline_depth,
+        "cipher": cipher,
+        "compression": compression,
+        "bundle": bundle == 'true'
+    }, password)
+    return {'job_id': job_id, 'state': QUEUED}, 202
+
+
+@app.route('/decrypt-files', methods=['POST'])
+@require_session_cookie
+def decrypt_files(session_id):
+    password = request.form.get('password')
+
+    if not password:
+        return {'error': 'Missing password'}, 400
+
+    try:
+        workers = parse_workers(request.form.get('workers'))
+        pipeline_depth = parse_pipeline_depth(request.form.get('pipelineDepth'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    cache_keys = request.form.get('cacheKeys')
+    if cache_keys not in (None, 'true', 'false'):
+        return {'error': 'Invalid cacheKeys state'}, 400
+
+    job_id = job_manager.submit(session_id, 'decrypt', {
+        "workers": workers,
+        "pipeline_depth": pipeline_depth,
+        "cache_keys": cache_keys == 'true',
+        "members": request.form.getlist('members') or None,
+        "pattern": request.form.get('pattern') or None,
+        "include": request.form.getlist('include') or None,
+        "exclude": request.form.getlist('exclude') or None
+    }, password)
+    return {'job_id': job_id, 'state': QUEUED}, 202
+
+
+def get_session_job(session_id, job_id):
+    job = job_manager.status(job_id)
+    if job is None or job["session_id"] != session_id:
+        return None
+    return job
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_session_cookie
+def job_status(session_id, job_id):
+    job = get_session_job(session_id, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+
+    status = {key: job[key] for key in ("id", "kind", "state", "created", "started", "finished", "progress")}
+    if "position" in job:
+        status["position"] = job["position"]
+    return status
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@require_session_cookie
+def cancel_job(session_id, job_id):
+    job = get_session_job(session_id, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+
+    if job["state"] in FINISHED_STATES or not job_manager.cancel(job_id):
+        return {'error': f'Job already {job["state"]}'}, 409
+    return {'message': 'Job cancellation requested', 'job_id': job_id}
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+@require_session_cookie
+def job_result(session_id, job_id):
+    job = get_session_job(session_id, job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+
+    if job["state"] not in FINISHED_STATES:
+        return {'error': 'Job has not finished yet', 'state': job["state"]}, 409
+    return job["result"], job["status_code"]
+
+
+@app.route('/scheduler', methods=['GET'])
+@require_session_cookie
+def scheduler_metrics(session_id):
+    return {**scheduler.metrics(session_id), 'jobs': job_manager.metrics()}
+
+
+@app.route('/list-files', methods=['POST'])
+@require_session_cookie
+def list_files(session_id):
+    password = request.form.get('password')
+
+    if not password:
+        return {'error': 'Missing password'}, 400
+
+    cache_keys = request.form.get('cacheKeys')
+    if cache_keys not in (None, 'true', 'false'):
+        return {'error': 'Invalid cacheKeys state'}, 400
+    key_cache = get_key_cache(session_id) if cache_keys == 'true' else None
+
+    try:
+        entries, password_errors, errors = list_directory(password, 1, session_id, key_cache=key_cache,
+                                                          executor=scheduler.lane(session_id, INTERACTIVE))
+    except FileNotFoundError:
+        return {'error': 'No uploaded files found'}, 400
+    except Exception as e:
+        return {'error': f'Error listing files: {str(e)}'}, 500
+
+    if not entries and password_errors > 0:
+        return {'error': 'Incorrect password for all encrypted files'}, 401
+
+    response = {'files': entries}
+    unchecked = sum(1 for entry in entries if not entry['checked'])
+    if password_errors > 0 or errors or unchecked > 0:
+        response['status'] = 'warning'
+        if password_errors > 0:
+            response['warning_password'] = f'{password_errors} file(s) skipped due to wrong password'
+        if unchecked > 0:
+            response['warning_unchecked'] = f'Password not checked for {unchecked} legacy file(s)'
+        if errors:
+            response['errors'] = errors
+    return response, 200
+
+
+@app.route('/verify-files', methods=['POST'])
+@require_session_cookie
+def verify_files(session_id):
+    password = request.form.get('password')
+
+    if not password:
+        return {'error': 'Missing password'}, 400
+
+    try:
+        workers = parse_workers(request.form.get('workers'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    cache_keys = request.form.get('cacheKeys')
+    if cache_keys not in (None, 'true', 'false'):
+        return {'error': 'Invalid cacheKeys state'}, 400
+    key_cache = get_key_cache(session_id) if cache_keys == 'true' else None
+
+    if not safe_add_active(session_id):
+        return {'error': 'Session is busy with another operation'}, 400
+
+    verified_files = 0
+    total_files = 0
+    try:
+        emit_progress(session_id, 'operation_started', {'operation': 'verify'})
+
+        report = verify_directory(password, 1, session_id,
+                                  progress_callback=lambda pct, info, cur, tot: emit_progress(
+                                      session_id, 'verify_progress',
+                                      {"percent": pct, "info": info, "current": cur, "total": tot}
+                                  ), workers=workers, key_cache=key_cache,
+                                  include=request.form.getlist('include') or None,
+                                  exclude=request.form.getlist('exclude') or None,
+                                  executor=scheduler.lane(session_id))
+
+        if report is None:
+            emit_progress(session_id, 'operation_error', {"error": "No encrypted files found!"})
+            return {'error': 'No encrypted files found'}, 400
+
+        total_files = len(report)
+        verified_files = sum(1 for entry in report if entry['status'] == 'ok')
+        response = {
+            'message': f'{verified_files} of {total_files} file(s) verified successfully!',
+            'files': report
+        }
+        if verified_files != total_files:
+            response['status'] = 'warning'
+        return response, 200
+    except Exception as e:
+        emit_progress(session_id, 'operation_error', {"error": f"Verification failed: {str(e)}"})
+        return {'error': f'Error verifying files: {str(e)}'}, 500
+    finally:
+        safe_remove_active(session_id)
+        emit_progress(session_id, 'operation_finished', {'operation': 'verify', "processed": verified_files, "total": total_files})
+
+
+@app.route('/rekey-files', methods=['POST'])
+@require_session_cookie
+def rekey_files(session_id):
+    password = request.form.get('password')
+    new_password = request.form.get('newPassword')
+
+    if not password or not new_password:
+        return {'error': 'Missing password or new password'}, 400
+
+    if not safe_add_active(session_id):
+        return {'error': 'Session is busy with another operation'}, 400
+
+    clear_output_directory(session_id)
+
+    total_files = 0
+    rekeyed_files = 0
+    try:
+        emit_progress(session_id, 'operation_started', {'operation': 'rekey'})
+
+        result = rekey_directory(password, new_password, 1, session_id,
+                                 progress_callback=lambda pct, info, cur, tot: emit_progress(
+                                     session_id, 'rekey_progress',
+                                     {"percent": pct, "info": info, "current": cur, "total": tot}
+                                 ))
+
+        if result is None:
+            emit_progress(session_id, 'operation_error', {"error": "No encrypted files found!"})
+            return {'error': 'No encrypted files found'}, 400
+
+        total_files, total_encrypted_files, rekeyed_files, password_errors, unsupported_files = result
+
+        if rekeyed_files == 0:
+            clear_output_directory(session_id)
+            if password_errors == total_encrypted_files:
+                emit_progress(session_id, 'operation_error', {"error": "No files with that password could be found!"})
+                return {'error': 'Incorrect password for all encrypted files'}, 401
+            if unsupported_files == total_encrypted_files:
+                emit_progress(session_id, 'operation_error', {"error": "Files must be re-encrypted to change their password"})
+                return {'error': 'Files use an older format and must be re-encrypted'}, 400
+            emit_progress(session_id, 'operation_error', {"error": "No files could be rekeyed!"})
+            return {'error': 'No files could be rekeyed!'}, 400
+
+        response = {
+            'message': f'{rekeyed_files} file(s) rekeyed successfully!'
+        }
+
+        if password_errors > 0 or unsupported_files > 0:
+            response['status'] = 'warning'
+            if password_errors > 0:
+                response['warning_password'] = f'{password_errors} file(s) skipped due to wrong password'
+            if unsupported_files > 0:
+                response['warning_format'] = f'{unsupported_files} file(s) use an older format'
+
+        return response, 200
+    except PermissionError:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": "Permission denied accessing files"})
+        return {'error': 'Permission denied accessing files'}, 500
+    except OSError as e:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": f"File system error: {str(e)}"})
+        return {'error': f'File system error: {str(e)}'}, 500
+    except ValueError as e:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": f"Invalid rekey data: {str(e)}"})
+        return {'error': f'Invalid rekey data: {str(e)}'}, 400
+    except Exception as e:
+        clear_output_directory(session_id)
+        emit_progress(session_id, 'operation_error', {"error": f"Rekey failed: {str(e)}"})
+        return {'error': f'Error rekeying files: {str(e)}'}, 500
+    finally:
+        safe_remove_active(session_id)
+        emit_progress(session_id, 'operation_finished', {'operation': 'rekey', "processed": rekeyed_files, "total": total_files})
+
+
 @app.route("/files", methods=['POST'])
 @require_session_cookie
 def files(session_id):
@@ -409,6 +897,210 @@ def download_file(session_id):
         return {'error': f'Error downloading file: {str(e)}'}, 500
 
 
+def stream_zip(session_id, folder, download_name, deflate=False):
+    # The file list comes from one scandir pass so progress can be reported
+    # in bytes; the archive itself is built while the response streams, so
+    # memory stays constant and the first bytes go out immediately.
+    files = [(entry.path, rel_path, entry.stat().st_size) for _, rel_path, entry in scan_files(folder)]
+    total_files = len(files)
+    total_bytes = sum(size for _, _, size in files)
+    current_file = 0
+    sent_bytes = 0
+    last_percent = -1
+
+    def members():
+        nonlocal current_file
+        for path, rel_path, _ in files:
+            current_file += 1
+            yield path, rel_path
+
+    def on_progress(arcname, n):
+        nonlocal sent_bytes, last_percent
+        sent_bytes += n
+        percent = int((sent_bytes / total_bytes) * 100) if total_bytes else 100
+        if percent != last_percent:
+            last_percent = percent
+            emit_progress(session_id, 'download_progress', {
+                "percent": percent,
+                "info": f"Streaming {arcname}",
+                "current": current_file,
+                "total": total_files
+            })
+
+    def generate():
+        if total_files > 0:
+            emit_progress(session_id, 'operation_started', {"operation": "download"})
+        try:
+            yield from iter_zip(members(), deflate, on_progress)
+        except Exception as e:
+            # Headers are already sent, so the error can only be reported
+            # over the socket; the truncated archive fails to open.
+            emit_progress(session_id, 'operation_error', {"error": f'Error downloading folder: {str(e)}'})
+            raise
+        if total_files > 0:
+            emit_progress(session_id, 'operation_finished', {
+                'operation': 'download',
+                "processed": current_file,
+                "total": total_files
+            })
+
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'}
+    )
+
+
+def resolve_session_path(root, rel_path):
+    # Joins a client supplied relative path (nested folders allowed) onto
+    # ``root``; None when the result would lie outside of it.
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, rel_path))
+    if path != root and not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def stream_decrypted_zip(session_id, files, download_name, password, key_cache, deflate=False, executor=None):
+    # Like stream_zip, but every member is decrypted while the archive is
+    # sent. Progress is approximated by comparing the plaintext sent with
+    # the size of the encrypted files.
+    total_bytes = sum(os.path.getsize(path) for _, path in files)
+    sent_bytes = 0
+    sent_files = 0
+    last_percent = -1
+    errors = []
+
+    def on_error(path, error):
+        errors.append(f"{path}: {str(error)}")
+
+    def members():
+        nonlocal sent_files
+        for member in iter_decrypted_files(password, files, key_cache, on_error, executor):
+            sent_files += 1
+            yield member
+
+    def on_progress(arcname, n):
+        nonlocal sent_bytes, last_percent
+        sent_bytes += n
+        percent = min(100, int((sent_bytes / total_bytes) * 100)) if total_bytes else 100
+        if percent != last_percent:
+            last_percent = percent
+            emit_progress(session_id, 'download_progress', {
+                "percent": percent,
+                "info": f"Decrypting {arcname}",
+                "current": sent_files,
+                "total": len(files)
+            })
+
+    def generate():
+        emit_progress(session_id, 'operation_started', {"operation": "download"})
+        try:
+            yield from iter_zip_streams(members(), deflate, on_progress)
+        except Exception as e:
+            emit_progress(session_id, 'operation_error', {"error": f'Error downloading decrypted files: {str(e)}'})
+            raise
+        emit_progress(session_id, 'operation_finished', {
+            'operation': 'download',
+            "processed": sent_files,
+            "total": sent_files,
+            "errors": errors
+        })
+
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'}
+    )
+
+
+@app.route("/download-decrypted", methods=['POST'])
+@require_session_cookie
+def download_decrypted(session_id):
+    # Decrypts while the response is sent, so no plaintext is written to
+    # disk. A single file supports Range requests where its format allows
+    # random access (chunked GCM without compression); folders and bundles
+    # are sent as a streamed ZIP.
+    password = request.form.get('password')
+    if not password:
+        return {'error': 'Missing password'}, 400
+
+    source = request.form.get('source') or 'uploads'
+    if source not in ('uploads', 'output'):
+        return {'error': 'Invalid source'}, 400
+
+    cache_keys = request.form.get('cacheKeys')
+    if cache_keys not in (None, 'true', 'false'):
+        return {'error': 'Invalid cacheKeys state'}, 400
+    key_cache = get_key_cache(session_id) if cache_keys == 'true' else None
+
+    root = os.path.join("files", "web", source, session_id)
+    path = resolve_session_path(root, request.form.get('filePath') or '')
+    if path is None:
+        return {'error': 'Invalid file path'}, 400
+    if not os.path.exists(path):
+        return {'error': 'File not found'}, 404
+
+    deflate = request.form.get('deflate') == 'true'
+    # Key derivation runs on the scheduler; a single file or bundle is
+    # interactive and goes ahead of bulk work, a whole folder is bulk.
+    lane = scheduler.lane(session_id, BULK if os.path.isdir(path) else INTERACTIVE)
+    try:
+        if os.path.isdir(path):
+            files = [(rel_dir, entry.path) for rel_dir, _, entry in scan_files(path)
+                     if entry.name.lower().endswith('.dat')]
+            if not files:
+                return {'error': 'No encrypted files found'}, 400
+            name = session_id if path == os.path.realpath(root) else os.path.basename(path)
+            return stream_decrypted_zip(session_id, files, f"{name}.zip", password, key_cache, deflate,
+                                        lane)
+
+        if is_bundle(path):
+            name = os.path.splitext(os.path.basename(path))[0]
+            return stream_decrypted_zip(session_id, [("", path)], f"{name}.zip", password, key_cache, deflate,
+                                        lane)
+
+        stream = open_decrypted(password, path, key_cache, lane)
+    except InvalidPasswordError:
+        return {'error': 'Incorrect password'}, 401
+    except DecryptionError as e:
+        return {'error': f'Error decrypting file: {str(e)}'}, 400
+    except Exception as e:
+        return {'error': f'Error downloading file: {str(e)}'}, 500
+
+    status = 200
+    headers = {}
+    if stream.seekable:
+        start, stop = 0, stream.size
+        headers['Accept-Ranges'] = 'bytes'
+        # Multi-range requests get the whole file.
+        if request.range is not None and len(request.range.ranges) == 1:
+            byte_range = request.range.range_for_length(stream.size)
+            if byte_range is None:
+                stream.close()
+                return Response(status=416, headers={'Content-Range': f'bytes */{stream.size}'})
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{stream.size}'
+        headers['Content-Length'] = str(stop - start)
+        chunks = stream.iter_range(start, stop)
+    else:
+        chunks = stream.iter_range()
+
+    def generate():
+        # Headers are already sent when a later chunk fails to decrypt, so
+        # the client only sees a truncated response.
+        try:
+            for chunk in chunks:
+                yield bytes(chunk)
+        finally:
+            stream.close()
+
+    response = Response(generate(), status=status, mimetype='application/octet-stream', headers=headers)
+    response.headers.set('Content-Disposition', 'attachment', filename=stream.name)
+    return response
+
+
 @app.route("/download-folder", methods=['POST'])
 @require_session_cookie
 def download_folder(session_id):
@@ -422,51 +1114,11 @@ def download_folder(session_id):
     folder_name = secure_filename(folder_name)
 
     folder = os.path.join("files", "web", "output", session_id, folder_name)
-    zip_buffer = io.BytesIO()
 
     if not os.path.exists(folder):
         return {'error': f'Session not found'}, 404
     try:
-        total_files = 0
-        for root, dirs, dir_files in os.walk(folder):
-            total_files += len(dir_files)
-
-        if total_files > 0:
-            emit_progress(session_id, 'operation_started', {"operation": "download"})
-
-        processed_files = 0
-        with zipfile.ZipFile(zip_buffer, "w") as zipf:
-            for root, dirs, dir_files in os.walk(folder):
-                for file in dir_files:
-                    file_path = os.path.join(root, file)
-                    archive_name = os.path.relpath(file_path, folder)
-
-                    if total_files > 0:
-                        progress_percent = int((processed_files / total_files) * 100)
-                        emit_progress(session_id, 'download_progress', {
-                            "percent": progress_percent,
-                            "info": f"Adding {file} to archive",
-                            "current": processed_files + 1,
-                            "total": total_files
-                        })
-
-                    zipf.write(file_path, archive_name)
-                    processed_files += 1
-
-        if total_files > 0:
-            emit_progress(session_id, 'operation_finished', {
-                'operation': 'download',
-                "processed": processed_files,
-                "total": total_files
-            })
-
-        zip_buffer.seek(0)
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=f"{folder_name}.zip",
-            mimetype="application/zip"
-        )
+        return stream_zip(session_id, folder, f"{folder_name}.zip", request.form.get('deflate') == 'true')
     except Exception as e:
         emit_progress(session_id, 'operation_error', {"error": f'Error downloading folder: {str(e)}'})
         return {'error': f'Error downloading folder: {str(e)}'}, 500
@@ -476,51 +1128,11 @@ def download_folder(session_id):
 @require_session_cookie
 def download_all(session_id):
     folder = os.path.join("files", "web", "output", session_id)
-    zip_buffer = io.BytesIO()
 
     if not os.path.exists(folder):
         return {'error': f'Session not found'}, 404
     try:
-        total_files = 0
-        for root, dirs, dir_files in os.walk(folder):
-            total_files += len(dir_files)
-
-        if total_files > 0:
-            emit_progress(session_id, 'operation_started', {"operation": "download"})
-
-        processed_files = 0
-        with zipfile.ZipFile(zip_buffer, "w") as zipf:
-            for root, dirs, dir_files in os.walk(folder):
-                for file in dir_files:
-                    file_path = os.path.join(root, file)
-                    archive_name = os.path.relpath(file_path, folder)
-
-                    if total_files > 0:
-                        progress_percent = int((processed_files / total_files) * 100)
-                        emit_progress(session_id, 'download_progress', {
-                            "percent": progress_percent,
-                            "info": f"Adding {file} to archive",
-                            "current": processed_files + 1,
-                            "total": total_files
-                        })
-
-                    zipf.write(file_path, archive_name)
-                    processed_files += 1
-
-        if total_files > 0:
-            emit_progress(session_id, 'operation_finished', {
-                'operation': 'download',
-                "processed": processed_files,
-                "total": total_files
-            })
-
-        zip_buffer.seek(0)
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=f"{session_id}.zip",
-            mimetype="application/zip"
-        )
+        return stream_zip(session_id, folder, f"{session_id}.zip", request.form.get('deflate') == 'true')
     except Exception as e:
         emit_progress(session_id, 'operation_error', {"error": f'Error downloading folder: {str(e)}'})
         return {'error': f'Error downloading folder: {str(e)}'}, 500
@@ -539,13 +1151,18 @@ def remove_session(session_id):
             shutil.rmtree(upload_dir)
         if os.path.exists(output_dir):
             shutil.rmtree(output_dir)
+        drop_key_cache(session_id)
+        if job_manager is not None:
+            job_manager.remove_session(session_id)
         delete_old_upload_dirs()
+        purge_key_caches()
         return jsonify({"message": "Session removed successfully!"})
     finally:
         safe_remove_active(session_id)
 
 
 def run_flask():
+    start_services()
     socketio.run(app, debug=True, use_reloader=False, allow_unsafe_werkzeug=True)
 
 
@@ -0,0 +1,284 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from src.utils.utils import OperationCancelledError
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_RETENTION = 24 * 3600
+SERVED_RETENTION = 3600
+SECRET_NONCE_SIZE = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    secret BLOB,
+    state TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    status_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+
+class JobStore:
+    # SQLite table of jobs, so queued work survives a restart. The password a
+    # job needs is sealed under a key kept in a separate owner-only file and
+    # is wiped once the job finishes, so the database alone never reveals it.
+    def __init__(self, path: str, key_path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._cipher = AESGCM(self._load_key(key_path))
+        self._lock = threading.Lock()
+        self._execute_script(SCHEMA)
+
+    @staticmethod
+    def _load_key(key_path: str) -> bytes:
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(key_path, "rb") as f:
+                return f.read()
+        key = AESGCM.generate_key(bit_length=256)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _execute_script(self, script: str):
+        with self._lock:
+            db = self._connect()
+            try:
+                db.executescript(script)
+            finally:
+                db.close()
+
+    def _execute(self, sql: str, args: tuple = ()) -> list:
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    return [dict(row) for row in db.execute(sql, args).fetchall()]
+            finally:
+                db.close()
+
+    def add(self, job_id: str, session_id: str, kind: str, params: dict, password: str):
+        nonce = os.urandom(SECRET_NONCE_SIZE)
+        secret = nonce + self._cipher.encrypt(nonce, password.encode(), job_id.encode())
+        self._execute(
+            "INSERT INTO jobs (id, session_id, kind, params, secret, state, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, session_id, kind, json.dumps(params), secret, QUEUED, time.time())
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._execute(
+            "SELECT id, session_id, kind, params, state, created, started, finished, result, status_code "
+            "FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        job = rows[0]
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def password(self, job_id: str) -> Optional[str]:
+        rows = self._execute("SELECT secret FROM jobs WHERE id = ?", (job_id,))
+        if not rows or rows[0]["secret"] is None:
+            return None
+        secret = rows[0]["secret"]
+        try:
+            return self._cipher.decrypt(secret[:SECRET_NONCE_SIZE], secret[SECRET_NONCE_SIZE:],
+                                        job_id.encode()).decode()
+        except InvalidTag:
+            return None
+
+    def mark_running(self, job_id: str):
+        self._execute("UPDATE jobs SET state = ?, started = ? WHERE id = ?", (RUNNING, time.time(), job_id))
+
+    def finish(self, job_id: str, state: str, result: dict, status_code: int):
+        self._execute(
+            "UPDATE jobs SET state = ?, finished = ?, result = ?, status_code = ?, secret = NULL WHERE id = ?",
+            (state, time.time(), json.dumps(result), status_code, job_id)
+        )
+
+    def delete_session(self, session_id: str):
+        # Running jobs hold the session guard, so a removed session has none.
+        self._execute("DELETE FROM jobs WHERE session_id = ? AND state != ?", (session_id, RUNNING))
+
+    def recover(self) -> list:
+        # Jobs that were running when the process stopped start over; their
+        # output directory is cleared again when they do.
+        self._execute("UPDATE jobs SET state = ?, started = NULL WHERE state = ?", (QUEUED, RUNNING))
+        self._execute(
+            f"DELETE FROM jobs WHERE state IN ({', '.join('?' * len(FINISHED_STATES))}) AND finished < ?",
+            (*FINISHED_STATES, time.time() - JOB_RETENTION)
+        )
+        return [row["id"] for row in self._execute("SELECT id FROM jobs WHERE state = ? ORDER BY created", (QUEUED,))]
+
+
+class JobManager:
+    # Runs stored jobs on a bounded pool of worker threads. Jobs of one
+    # session run one at a time in submission order: a worker only takes a
+    # job once ``acquire`` grants its session, the same guard the other
+    # endpoints use, so a job also waits for e.g. an upload to finish.
+    # Across sessions jobs are taken round-robin, the session served least
+    # recently first, so a session queueing many jobs cannot hold the others
+    # back.
+    def __init__(self, store: JobStore, runners: dict, workers: int, acquire: Callable, release: Callable):
+        self.store = store
+        self._runners = runners
+        self._workers = workers
+        self._acquire = acquire
+        self._release = release
+        self._queue = []
+        self._cancel_events = {}
+        self._progress = {}
+        self._served = {}
+        self._condition = threading.Condition()
+        self._started = False
+
+    def start(self):
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+            self._queue.extend(job_id for job_id in self.store.recover() if job_id not in self._queue)
+        for index in range(self._workers):
+            threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True).start()
+
+    def submit(self, session_id: str, kind: str, params: dict, password: str) -> str:
+        if kind not in self._runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        self.store.add(job_id, session_id, kind, params, password)
+        with self._condition:
+            self._queue.append(job_id)
+            self._condition.notify()
+        self.start()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._condition:
+            job["progress"] = self._progress.get(job_id)
+            if job_id in self._queue:
+                job["position"] = self._queue.index(job_id)
+        return job
+
+    def metrics(self) -> dict:
+        with self._condition:
+            return {"workers": self._workers, "queued": len(self._queue), "running": len(self._cancel_events)}
+
+    def report_progress(self, job_id: str, payload: dict):
+        self._progress[job_id] = payload
+
+    def cancel(self, job_id: str) -> bool:
+        # Queued jobs are dropped at once; running ones stop dispatching new
+        # files and finish as cancelled once the files in flight are done.
+        with self._condition:
+            if job_id in self._queue:
+                self._queue.remove(job_id)
+                self.store.finish(job_id, CANCELLED, {"error": "Job cancelled"}, 409)
+                return True
+            cancel_event = self._cancel_events.get(job_id)
+            if cancel_event is None:
+                return False
+            cancel_event.set()
+            return True
+
+    def remove_session(self, session_id: str):
+        # Drops every job of a removed session, including the sealed
+        # passwords of those still queued.
+        with self._condition:
+            self.store.delete_session(session_id)
+            for job_id in list(self._queue):
+                if self.store.get(job_id) is None:
+                    self._queue.remove(job_id)
+                    self._progress.pop(job_id, None)
+            self._served.pop(session_id, None)
+
+    def _next_job(self) -> Optional[dict]:
+        candidates = {}
+        for job_id in list(self._queue):
+            job = self.store.get(job_id)
+            if job is None or job["state"] != QUEUED:
+                self._queue.remove(job_id)
+                continue
+            candidates.setdefault(job["session_id"], job)
+
+        now = time.monotonic()
+        self._served = {session_id: served for session_id, served in self._served.items()
+                        if session_id in candidates or now - served < SERVED_RETENTION}
+        # The sort is stable, so sessions never served keep queue order.
+        for session_id in sorted(candidates, key=lambda session_id: self._served.get(session_id, 0.0)):
+            if self._acquire(session_id):
+                job = candidates[session_id]
+                self._queue.remove(job["id"])
+                self._served[session_id] = now
+                self._cancel_events[job["id"]] = threading.Event()
+                return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    # Session guards are also released outside the manager,
+                    # so blocked jobs are retried periodically.
+                    self._condition.wait(timeout=1.0)
+                    job = self._next_job()
+                cancel_event = self._cancel_events[job["id"]]
+            try:
+                self._execute(job, cancel_event)
+            finally:
+                self._release(job["session_id"])
+                with self._condition:
+                    self._cancel_events.pop(job["id"], None)
+                    self._progress.pop(job["id"], None)
+                    self._condition.notify_all()
+
+    def _execute(self, job: dict, cancel_event: threading.Event):
+        password = self.store.password(job["id"])
+        if password is None:
+            self.store.finish(job["id"], FAILED, {"error": "Job password is no longer available"}, 500)
+            return
+
+        self.store.mark_running(job["id"])
+        try:
+            result, status_code = self._runners[job["kind"]](
+                job["id"], job["session_id"], job["params"], password, cancel_event
+            )
+        except OperationCancelledError as e:
+            self.store.finish(job["id"], CANCELLED, {"error": str(e)}, 409)
+            return
+        except Exception as e:
+            self.store.finish(job["id"], FAILED, {"error": f"Job failed: {str(e)}"}, 500)
+            return
+        self.store.finish(job["id"], SUCCEEDED if status_code < 400 else FAILED, result, status_code)
@@ -1,5 +1,61 @@
-from src.decryption.decryption import decrypt_file, decrypt_directory
+from src.decryption.decryption import decrypt_file, decrypt_directory, list_directory, verify_directory
 from src.encryption.encryption import encrypt_file, encrypt_directory
+from src.rekey.rekey import rekey_file, rekey_directory
+
+
+def ask_workers():
+    workers = input("Parallel workers (Enter for 1): ")
+    while workers and (not workers.isdigit() or int(workers) < 1):
+        print('Please enter a positive number or leave it empty')
+        workers = input()
+    return int(workers) if workers else 1
+
+
+def ask_cipher():
+    authenticated = input("Use authenticated chunked format (y/n): ")
+    while authenticated != 'y' and authenticated != 'n':
+        print('Please enter "y" for yes or "n" for no')
+        authenticated = input()
+    return "gcm" if authenticated == 'y' else "cbc"
+
+
+def ask_compression():
+    compression = input("Compression (none/zlib/lzma, Enter for none): ")
+    while compression not in ('', 'none', 'zlib', 'lzma'):
+        print('Please enter "none", "zlib" or "lzma" or leave it empty')
+        compression = input()
+    return compression or "none"
+
+
+def ask_bundle():
+    bundle = input("Pack all files into one bundle (y/n): ")
+    while bundle != 'y' and bundle != 'n':
+        print('Please enter "y" for yes or "n" for no')
+        bundle = input()
+    return bundle == 'y'
+
+
+def ask_incremental():
+    incremental = input("Only encrypt new or changed files (y/n): ")
+    while incremental != 'y' and incremental != 'n':
+        print('Please enter "y" for yes or "n" for no')
+        incremental = input()
+    return incremental == 'y'
+
+
+def ask_globs(prompt):
+    globs = input(f"{prompt}, comma separated globs (Enter for none): ")
+    return [glob.strip() for glob in globs.split(",") if glob.strip()] or None
+
+
+def ask_pattern():
+    pattern = input("Only decrypt files whose name matches (glob, Enter for all): ")
+    return pattern or None
+
+
+def ask_members():
+    members = input("Bundle members to extract, comma separated (Enter for all): ")
+    return [member.strip() for member in members.split(",") if member.strip()] or None
 
 
 def encrypt():
@@ -12,7 +68,10 @@ def encrypt():
         while encrypt_name != 'y' and encrypt_name != 'n':
             print('Please enter "y" for yes or "n" for no')
             encrypt_name = input()
-        encrypt_file(password, filename, encrypt_name == 'y')
+        cipher = ask_cipher()
+        compression = ask_compression()
+        workers = ask_workers() if cipher == "gcm" and compression == "none" else 1
+        encrypt_file(password, filename, encrypt_name == 'y', cipher, workers, compression)
     elif mode == 'd':
         print("Put all files to encrypt in the 'files/input/' directory.")
         password = input("Password: ")
@@ -20,7 +79,16 @@ def encrypt():
         while encrypt_name != 'y' and encrypt_name != 'n':
             print('Please enter "y" for yes or "n" for no')
             encrypt_name = input()
-        encrypt_directory(password, 0, encrypt_name == 'y')
+        bundle = ask_bundle()
+        if bundle:
+            cipher, compression, workers, incremental = "gcm", "none", 1, False
+        else:
+            cipher = ask_cipher()
+            compression = ask_compression()
+            workers = ask_workers()
+            incremental = ask_incremental()
+        encrypt_directory(password, 0, encrypt_name == 'y', workers=workers, cipher=cipher, bundle=bundle,
+                          compression=compression, incremental=incremental)
     else:
         print("Invalid mode. Please try again.")
         return
@@ -32,12 +100,50 @@ def decrypt():
     if mode == 'f':
         filename = input("Enter filename: ")
         password = input("Password: ")
-        decrypt_file(password, filename)
+        workers = ask_workers()
+        decrypt_file(password, filename, workers)
     elif mode == 'd':
         print("Put all encrypted files in the 'files/encrypted/' directory to encrypt.")
         print("Files with another password will be ignored.")
         password = input("Password: ")
-        decrypt_directory(password, 0)
+        workers = ask_workers()
+        members = ask_members()
+        pattern = ask_pattern()
+        include = ask_globs("Only decrypt paths matching")
+        exclude = ask_globs("Skip paths matching")
+        decrypt_directory(password, 0, workers=workers, members=members, pattern=pattern, include=include,
+                          exclude=exclude)
     else:
         print("Invalid mode. Please try again.")
-        return
\ No newline at end of file
+        return
+
+
+def list_files():
+    print("Original names, sizes and timestamps of the files in 'files/encrypted/':")
+    password = input("Password: ")
+    list_directory(password, 0)
+
+
+def verify():
+    print("Checks that every file in 'files/encrypted/' decrypts with the password, without writing anything.")
+    password = input("Password: ")
+    workers = ask_workers()
+    verify_directory(password, 0, workers=workers)
+
+
+def rekey():
+    print("Do you want to change the password of a file or the encrypted directory?")
+    mode = input("Enter (f/d): ")
+    if mode == 'f':
+        filename = input("Enter filename: ")
+        password = input("Current password: ")
+        new_password = input("New password: ")
+        rekey_file(password, new_password, filename)
+    elif mode == 'd':
+        print("All encrypted files in the 'files/encrypted/' directory will get the new password.")
+        password = input("Current password: ")
+        new_password = input("New password: ")
+        rekey_directory(password, new_password, 0)
+    else:
+        print("Invalid mode. Please try again.")
+        return
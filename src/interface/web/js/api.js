@@ -54,12 +54,27 @@ export async function downloadAll() {
     });
 }
 
+const JOB_POLL_INTERVAL = 1000;
+const FINISHED_JOB_STATES = ['succeeded', 'failed', 'cancelled'];
+
 export async function performCryptoOperation(endpoint, formData) {
     const response = await fetch(endpoint, {
         ...DEFAULT_FETCH_OPTIONS,
         body: formData
     });
-    return await response.json();
+    const job = await response.json();
+    if (!job.job_id) return job;
+
+    // The operation runs as a background job; wait for it to finish and
+    // return its result, which has the same shape as the old response.
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+        const status = await (await fetch(`/jobs/${job.job_id}`, { credentials: 'same-origin' })).json();
+        if (status.error) return status;
+        if (FINISHED_JOB_STATES.includes(status.state)) break;
+    }
+    const result = await fetch(`/jobs/${job.job_id}/result`, { credentials: 'same-origin' });
+    return await result.json();
 }
 
 export async function removeSession() {
@@ -2,7 +2,7 @@ import os
 import threading
 
 from src.interface.backend.flask_interface import run_flask
-from src.interface.interface import decrypt, encrypt
+from src.interface.interface import decrypt, encrypt, list_files, rekey, verify
 
 # mode 0 = console, mode 1 = web, mode 2 = application
 operation_mode = 1
@@ -12,13 +12,22 @@ def run():
         print("Modes:")
         print("1. Encrypt")
         print("2. Decrypt")
-        print("3. Exit")
+        print("3. Change password")
+        print("4. List encrypted files")
+        print("5. Verify encrypted files")
+        print("6. Exit")
         mode = input("Enter mode: ")
         if mode == "1":
             encrypt()
         elif mode == "2":
             decrypt()
         elif mode == "3":
+            rekey()
+        elif mode == "4":
+            list_files()
+        elif mode == "5":
+            verify()
+        elif mode == "6":
             exit()
         else:
             print("Invalid mode. Please try again.")
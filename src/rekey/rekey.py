@@ -0,0 +1,198 @@
+import os
+import shutil
+from typing import Optional, Callable
+
+from src.decryption.decryption import FileCorruptionError, InvalidPasswordError
+from src.utils import container, utils
+from src.utils.traversal import scan_files
+from src.utils.utils import derive_key
+
+
+class RekeyError(Exception):
+    pass
+
+
+class UnsupportedFormatError(RekeyError):
+    pass
+
+
+def _safe_progress_callback(callback: Optional[Callable], *args):
+    if callback:
+        try:
+            callback(*args)
+        except Exception:
+            pass
+
+
+def _rekey_in_place(enc_path: str, password: str, new_master_key: bytes, new_kdf_salt: bytes,
+                    old_master_keys: dict):
+    # Only the header is rewritten; the new one has exactly the same size, so
+    # the encrypted body is never read or moved.
+    with open(enc_path, "r+b") as f:
+        try:
+            header = container.read_header(f)
+        except container.ContainerError as e:
+            raise FileCorruptionError(str(e))
+        if header is None or header.wrapped_key is None:
+            raise UnsupportedFormatError("File has no wrapped data key - re-encrypt it to change its password")
+        header_size = f.tell()
+
+        kdf_params = (header.kdf_salt, header.kdf_iterations)
+        if kdf_params not in old_master_keys:
+            old_master_keys[kdf_params] = derive_key(password.encode(), *kdf_params)
+        data_key = utils.unwrap_file_key(old_master_keys[kdf_params], header.nonce, header.wrapped_key)
+        if data_key is None:
+            raise InvalidPasswordError("Rekey failed - incorrect password")
+
+        new_header = header.rekeyed(
+            new_kdf_salt, utils.PBKDF2_ITERATIONS, utils.wrap_file_key(new_master_key, header.nonce, data_key)
+        ).pack()
+        if len(new_header) != header_size:
+            raise RekeyError("Header size changed during rekey")
+
+        f.seek(0)
+        f.write(new_header)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _rekey_manifest(root_in: str, password: str, new_master_key: bytes, new_kdf_salt: bytes,
+                    old_master_keys: dict):
+    manifest_path = root_in.rstrip(os.sep) + utils.MANIFEST_SUFFIX
+    if not os.path.isfile(manifest_path):
+        return
+    try:
+        _rekey_in_place(manifest_path, password, new_master_key, new_kdf_salt, old_master_keys)
+    except (InvalidPasswordError, UnsupportedFormatError, FileCorruptionError, RekeyError, OSError) as e:
+        # A manifest left under another password would stop the next
+        # incremental run; without one, that run rebuilds the directory.
+        os.remove(manifest_path)
+        print(f"Warning: incremental manifest removed ({str(e)}); the next incremental run re-encrypts everything")
+
+
+def rekey_file(password: str, new_password: str, encrypted_filename: str):
+    if not password or not new_password:
+        raise ValueError("Password cannot be empty")
+
+    if not encrypted_filename:
+        raise ValueError("Filename cannot be empty")
+
+    enc_path = os.path.join("files", "encrypted", f"{encrypted_filename}.dat")
+    if not os.path.exists(enc_path):
+        raise FileNotFoundError(f"File '{encrypted_filename}.dat' not found")
+
+    new_kdf_salt = os.urandom(16)
+    new_master_key = derive_key(new_password.encode(), new_kdf_salt)
+    try:
+        _rekey_in_place(enc_path, password, new_master_key, new_kdf_salt, {})
+        print(f"Password of '{enc_path}' changed.\n")
+    except (OSError, IOError) as e:
+        if e.errno in [13, 1]:
+            raise PermissionError("Permission denied accessing file") from e
+        raise RekeyError(f"File system error: {str(e)}") from e
+
+
+def rekey_directory(password: str, new_password: str, mode: int, sessionID: str = None, progress_callback=None):
+    if not password or not new_password:
+        raise ValueError("Password cannot be empty")
+
+    if mode == 0:
+        if not os.path.exists("files/encrypted/"):
+            raise FileNotFoundError("'files/encrypted/' not found")
+        root_in = os.path.join("files", "encrypted")
+        root_out = None
+    elif mode == 1:
+        if not sessionID:
+            raise ValueError("Session ID required for web mode")
+        upload_dir = os.path.join("files", "web", "uploads", sessionID)
+        if not os.path.exists(upload_dir):
+            raise FileNotFoundError(f"Upload directory not found for session {sessionID}")
+        root_in = upload_dir
+        root_out = os.path.join("files", "web", "output", sessionID)
+        os.makedirs(root_out, exist_ok=True)
+    else:
+        raise ValueError(f"Invalid mode: {mode}")
+
+    total_files = 0
+    paths = []
+    for _, _, entry in scan_files(root_in):
+        total_files += 1
+        if entry.name.lower().endswith('.dat'):
+            paths.append(entry.path)
+
+    if not paths:
+        if mode == 0:
+            print("No encrypted files found to rekey.\n")
+        return None
+
+    # One PBKDF2 run for the new password; the old one is derived once per salt.
+    new_kdf_salt = os.urandom(16)
+    new_master_key = derive_key(new_password.encode(), new_kdf_salt)
+    old_master_keys = {}
+
+    rekeyed_files = 0
+    password_errors = 0
+    unsupported_files = 0
+    other_errors = []
+
+    for enc_path in paths:
+        item = os.path.basename(enc_path)
+        try:
+            _rekey_in_place(enc_path, password, new_master_key, new_kdf_salt, old_master_keys)
+        except InvalidPasswordError:
+            password_errors += 1
+            continue
+        except UnsupportedFormatError:
+            unsupported_files += 1
+            continue
+        except (FileCorruptionError, RekeyError, OSError) as e:
+            other_errors.append(f"{item}: {str(e)}")
+            continue
+
+        if root_out is not None:
+            # Web sessions serve results from the output directory; a hard
+            # link publishes the rekeyed file there without copying it.
+            out_path = os.path.join(root_out, os.path.relpath(enc_path, root_in))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            try:
+                os.link(enc_path, out_path)
+            except OSError:
+                shutil.copy2(enc_path, out_path)
+
+        rekeyed_files += 1
+        _safe_progress_callback(
+            progress_callback,
+            int((rekeyed_files / len(paths)) * 100),
+            f"Rekeyed {item}",
+            rekeyed_files,
+            len(paths)
+        )
+
+    if mode == 0 and rekeyed_files > 0:
+        # The incremental-encryption manifest is rekeyed after the files, so
+        # later incremental runs keep working with the new password. It is
+        # not one of the user's files and stays out of the counts.
+        _rekey_manifest(root_in, password, new_master_key, new_kdf_salt, old_master_keys)
+
+    if mode == 0:
+        if password_errors > 0:
+            print(f"Warning: {password_errors} files skipped due to wrong password")
+        if unsupported_files > 0:
+            print(f"Warning: {unsupported_files} files use an older format and must be re-encrypted")
+        if other_errors:
+            print(f"Warning: {len(other_errors)} files had errors:")
+            for error in other_errors[:5]:
+                print(f"  - {error}")
+            if len(other_errors) > 5:
+                print(f"  ... and {len(other_errors) - 5} more")
+
+        if rekeyed_files == 0:
+            print("No files rekeyed.\n")
+        elif rekeyed_files == 1:
+            print(f"{rekeyed_files} file rekeyed in '{root_in}'.\n")
+        else:
+            print(f"{rekeyed_files} files rekeyed in '{root_in}'.\n")
+        return None
+    elif mode == 1:
+        return total_files, len(paths), rekeyed_files, password_errors, unsupported_files
+    return None
@@ -0,0 +1,118 @@
+import lzma
+import zlib
+
+from src.utils.container import COMPRESSION_LZMA, COMPRESSION_NONE, COMPRESSION_ZLIB, ContainerError
+from src.utils.utils import CHUNK_SIZE
+
+# Already-compressed inputs (media, archives) barely shrink; a fast zlib pass
+# over a few samples decides whether the real compressor is worth running.
+PROBE_SAMPLE_SIZE = 64 * 1024
+PROBE_SAMPLES = 3
+PROBE_MAX_RATIO = 0.9
+
+
+def new_compressor(compression: int):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compressobj(6)
+    if compression == COMPRESSION_LZMA:
+        return lzma.LZMACompressor(lzma.FORMAT_XZ)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def is_compressible(path: str) -> bool:
+    size = 0
+    compressed = 0
+    with open(path, "rb") as src:
+        file_size = src.seek(0, 2)
+        step = max(PROBE_SAMPLE_SIZE, file_size // PROBE_SAMPLES)
+        for offset in range(0, min(file_size, step * PROBE_SAMPLES), step):
+            src.seek(offset)
+            sample = src.read(PROBE_SAMPLE_SIZE)
+            size += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+    return size > 0 and compressed < size * PROBE_MAX_RATIO
+
+
+class CompressingReader:
+    # Presents ``prefix`` followed by the contents of ``src`` as a compressed
+    # stream with a readinto interface, so it can stand in for the input file.
+    def __init__(self, src, compression: int, prefix: bytes = b""):
+        self._src = src
+        self._compressor = new_compressor(compression)
+        self._in_buffer = bytearray(CHUNK_SIZE)
+        self._pending = self._compressor.compress(prefix) if prefix else b""
+        self._offset = 0
+        self._eof = False
+
+    def _refill(self):
+        self._pending = b""
+        self._offset = 0
+        while not self._pending and not self._eof:
+            n = self._src.readinto(self._in_buffer)
+            if n:
+                self._pending = self._compressor.compress(memoryview(self._in_buffer)[:n])
+            else:
+                self._pending = self._compressor.flush()
+                self._eof = True
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        if self._offset >= len(self._pending):
+            self._refill()
+        n = min(len(view), len(self._pending) - self._offset)
+        view[:n] = self._pending[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        buffer = bytearray(CHUNK_SIZE if size < 0 else size)
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+
+def _new_decompressor(compression: int):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompressobj()
+    if compression == COMPRESSION_LZMA:
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def iter_decompressed(chunks, compression: int):
+    # Output is produced in pieces of at most CHUNK_SIZE bytes, so a small
+    # ciphertext that inflates to gigabytes never has to fit in memory.
+    if compression == COMPRESSION_NONE:
+        yield from chunks
+        return
+
+    decompressor = _new_decompressor(compression)
+    try:
+        for chunk in chunks:
+            if decompressor.eof:
+                if len(chunk):
+                    raise ContainerError("Unexpected data after compressed stream")
+                continue
+            if compression == COMPRESSION_ZLIB:
+                data = bytes(chunk)
+                while not decompressor.eof:
+                    out = decompressor.decompress(data, CHUNK_SIZE)
+                    data = decompressor.unconsumed_tail
+                    if not out and not data:
+                        break
+                    if out:
+                        yield out
+            else:
+                out = decompressor.decompress(bytes(chunk), CHUNK_SIZE)
+                while True:
+                    if out:
+                        yield out
+                    if decompressor.eof or decompressor.needs_input:
+                        break
+                    out = decompressor.decompress(b"", CHUNK_SIZE)
+            if decompressor.unused_data:
+                raise ContainerError("Unexpected data after compressed stream")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ContainerError(f"Compressed data is corrupted: {str(e)}") from e
+
+    if not decompressor.eof:
+        raise ContainerError("Compressed data is truncated")
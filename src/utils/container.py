@@ -0,0 +1,261 @@
+import json
+import struct
+from typing import Optional
+
+# Versioned container layout:
+#   MAGIC (4) | version (1) | flags (1) | fields length (2) | fields
+# Each field is tag (1) | length (2) | value. Files without the magic are
+# legacy salt|iv|ciphertext files.
+MAGIC = b"FENC"
+VERSION = 2
+PREFIX_SIZE = 8
+
+FLAG_EMBEDDED_NAME = 0x01
+FLAG_BUNDLE = 0x02
+
+FIELD_KDF = 1
+FIELD_NONCE = 2
+FIELD_IV = 3
+FIELD_KEY_CHECK = 4
+FIELD_CIPHER = 5
+FIELD_COMPRESSION = 6
+FIELD_WRAPPED_KEY = 7
+FIELD_METADATA = 8
+
+WRAPPED_KEY_SIZE = 40
+MIN_METADATA_SIZE = 12 + 16
+MAX_METADATA_SIZE = 4096
+
+CIPHER_CBC = 0
+CIPHER_GCM = 1
+CIPHERS = {"cbc": CIPHER_CBC, "gcm": CIPHER_GCM}
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB, "lzma": COMPRESSION_LZMA}
+
+GCM_CHUNK_SIZE = 64 * 1024
+GCM_TAG_SIZE = 16
+
+REQUIRED_FIELDS = (FIELD_KDF, FIELD_NONCE, FIELD_IV)
+
+
+class ContainerError(ValueError):
+    pass
+
+
+class ContainerHeader:
+    def __init__(self, flags: int = 0, fields: Optional[dict] = None):
+        self.flags = flags
+        self.fields = dict(fields or {})
+
+    @classmethod
+    def create(cls, kdf_salt: bytes, iterations: int, nonce: bytes, iv: bytes, flags: int = 0,
+               key_check: Optional[bytes] = None, cipher: int = CIPHER_CBC, chunk_size: int = 0,
+               compression: int = COMPRESSION_NONE, wrapped_key: Optional[bytes] = None,
+               metadata: Optional[bytes] = None):
+        header = cls(flags)
+        header.fields[FIELD_KDF] = struct.pack(">I", iterations) + kdf_salt
+        header.fields[FIELD_NONCE] = nonce
+        header.fields[FIELD_IV] = iv
+        header.fields[FIELD_CIPHER] = struct.pack(">BI", cipher, chunk_size)
+        if key_check is not None:
+            header.fields[FIELD_KEY_CHECK] = key_check
+        if compression != COMPRESSION_NONE:
+            header.fields[FIELD_COMPRESSION] = struct.pack(">B", compression)
+        if wrapped_key is not None:
+            header.fields[FIELD_WRAPPED_KEY] = wrapped_key
+        if metadata is not None:
+            header.fields[FIELD_METADATA] = metadata
+        return header
+
+    def rekeyed(self, kdf_salt: bytes, iterations: int, wrapped_key: bytes):
+        # Same header with a new password: only the KDF parameters and the
+        # wrapped data key change, and both keep their size.
+        header = ContainerHeader(self.flags, self.fields)
+        header.fields[FIELD_KDF] = struct.pack(">I", iterations) + kdf_salt
+        header.fields[FIELD_WRAPPED_KEY] = wrapped_key
+        return header
+
+    @property
+    def kdf_iterations(self) -> int:
+        return struct.unpack(">I", self.fields[FIELD_KDF][:4])[0]
+
+    @property
+    def kdf_salt(self) -> bytes:
+        return self.fields[FIELD_KDF][4:]
+
+    @property
+    def nonce(self) -> bytes:
+        return self.fields[FIELD_NONCE]
+
+    @property
+    def iv(self) -> bytes:
+        return self.fields[FIELD_IV]
+
+    @property
+    def wrapped_key(self) -> Optional[bytes]:
+        return self.fields.get(FIELD_WRAPPED_KEY)
+
+    @property
+    def metadata(self) -> Optional[bytes]:
+        return self.fields.get(FIELD_METADATA)
+
+    @property
+    def key_check(self) -> Optional[bytes]:
+        return self.fields.get(FIELD_KEY_CHECK)
+
+    @property
+    def cipher(self) -> int:
+        if FIELD_CIPHER not in self.fields:
+            return CIPHER_CBC
+        return self.fields[FIELD_CIPHER][0]
+
+    @property
+    def chunk_size(self) -> int:
+        if FIELD_CIPHER not in self.fields:
+            return 0
+        return struct.unpack(">I", self.fields[FIELD_CIPHER][1:5])[0]
+
+    @property
+    def compression(self) -> int:
+        if FIELD_COMPRESSION not in self.fields:
+            return COMPRESSION_NONE
+        return self.fields[FIELD_COMPRESSION][0]
+
+    @property
+    def has_embedded_name(self) -> bool:
+        return bool(self.flags & FLAG_EMBEDDED_NAME)
+
+    @property
+    def is_bundle(self) -> bool:
+        return bool(self.flags & FLAG_BUNDLE)
+
+    def pack(self) -> bytes:
+        body = b"".join(
+            struct.pack(">BH", tag, len(value)) + value
+            for tag, value in sorted(self.fields.items())
+        )
+        if len(body) > 0xFFFF:
+            raise ContainerError("Container header too large")
+        return MAGIC + struct.pack(">BBH", VERSION, self.flags, len(body)) + body
+
+    @property
+    def size(self) -> int:
+        return len(self.pack())
+
+
+def read_header(src) -> Optional[ContainerHeader]:
+    # Returns None for legacy files; the caller is responsible for rewinding.
+    prefix = src.read(PREFIX_SIZE)
+    if len(prefix) < PREFIX_SIZE or prefix[:4] != MAGIC:
+        return None
+
+    version, flags, body_length = struct.unpack(">BBH", prefix[4:])
+    if version != VERSION:
+        raise ContainerError(f"Unsupported container version: {version}")
+
+    body = src.read(body_length)
+    if len(body) != body_length:
+        raise ContainerError("Container header is truncated")
+
+    fields = {}
+    offset = 0
+    while offset < body_length:
+        if offset + 3 > body_length:
+            raise ContainerError("Container header is truncated")
+        tag, length = struct.unpack(">BH", body[offset:offset + 3])
+        offset += 3
+        if offset + length > body_length:
+            raise ContainerError("Container header is truncated")
+        fields[tag] = body[offset:offset + length]
+        offset += length
+
+    if any(tag not in fields for tag in REQUIRED_FIELDS):
+        raise ContainerError("Container header is missing required fields")
+
+    header = ContainerHeader(flags, fields)
+    if len(header.fields[FIELD_KDF]) != 20 or len(header.iv) != 16 or len(header.nonce) != 16:
+        raise ContainerError("Container header has invalid field sizes")
+    if FIELD_CIPHER in fields and len(fields[FIELD_CIPHER]) != 5:
+        raise ContainerError("Container header has invalid field sizes")
+    if FIELD_WRAPPED_KEY in fields and len(fields[FIELD_WRAPPED_KEY]) != WRAPPED_KEY_SIZE:
+        raise ContainerError("Container header has invalid field sizes")
+    if FIELD_METADATA in fields and not MIN_METADATA_SIZE <= len(fields[FIELD_METADATA]) <= MAX_METADATA_SIZE:
+        raise ContainerError("Container header has invalid field sizes")
+    if FIELD_COMPRESSION in fields and len(fields[FIELD_COMPRESSION]) != 1:
+        raise ContainerError("Container header has invalid field sizes")
+    if header.compression not in COMPRESSIONS.values():
+        raise ContainerError(f"Unsupported compression: {header.compression}")
+    if header.is_bundle and header.compression != COMPRESSION_NONE:
+        raise ContainerError("Bundles cannot be compressed")
+    if header.cipher not in CIPHERS.values():
+        raise ContainerError(f"Unsupported cipher: {header.cipher}")
+    if header.cipher == CIPHER_GCM and header.chunk_size == 0:
+        raise ContainerError("Chunked container is missing its chunk size")
+    if header.is_bundle and header.cipher != CIPHER_GCM:
+        raise ContainerError("Bundles require the chunked format")
+    return header
+
+
+# Chunked GCM bodies are a sequence of ciphertext || tag records of
+# ``chunk_size`` plaintext bytes each (the last one may be shorter). Every
+# chunk has its own nonce and is bound to its index and to whether it is the
+# final chunk, so chunks cannot be reordered, dropped or truncated unnoticed.
+def chunk_nonce(iv: bytes, index: int) -> bytes:
+    return iv[:4] + struct.pack(">Q", index)
+
+
+def chunk_aad(index: int, last: bool) -> bytes:
+    return struct.pack(">QB", index, 1 if last else 0)
+
+
+def chunk_count(payload_length: int, chunk_size: int) -> int:
+    return max(1, -(-payload_length // chunk_size))
+
+
+def chunked_payload_length(body_length: int, chunk_size: int) -> int:
+    record_size = chunk_size + GCM_TAG_SIZE
+    full, rest = divmod(body_length, record_size)
+    if body_length == 0 or (rest and rest <= GCM_TAG_SIZE):
+        raise ContainerError("Invalid chunked ciphertext length")
+    return body_length - (full + (1 if rest else 0)) * GCM_TAG_SIZE
+
+
+# A bundle payload is the concatenated member data, followed by a JSON index
+# of the members and the index length as a big-endian u64 trailer.
+BUNDLE_INDEX_VERSION = 1
+BUNDLE_TRAILER_SIZE = 8
+
+
+def _validate_member_path(path) -> str:
+    if not isinstance(path, str) or not path or "\x00" in path or "\\" in path or path.startswith("/"):
+        raise ContainerError(f"Invalid bundle member path: {path!r}")
+    if any(part in ("", ".", "..") for part in path.split("/")):
+        raise ContainerError(f"Invalid bundle member path: {path!r}")
+    return path
+
+
+def pack_bundle_index(members: list) -> bytes:
+    index = json.dumps({"version": BUNDLE_INDEX_VERSION, "members": members}, separators=(",", ":")).encode("utf-8")
+    return index + struct.pack(">Q", len(index))
+
+
+def unpack_bundle_index(data: bytes) -> list:
+    try:
+        index = json.loads(data.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ContainerError(f"Bundle index is corrupted: {str(e)}")
+    if not isinstance(index, dict) or index.get("version") != BUNDLE_INDEX_VERSION:
+        raise ContainerError("Unsupported bundle index")
+
+    members = index.get("members")
+    if not isinstance(members, list):
+        raise ContainerError("Bundle index is corrupted")
+    for member in members:
+        if not isinstance(member, dict) or not all(
+                isinstance(member.get(field), int) and member[field] >= 0 for field in ("offset", "size")):
+            raise ContainerError("Bundle index is corrupted")
+        _validate_member_path(member.get("path"))
+    return members
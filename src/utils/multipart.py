@@ -0,0 +1,54 @@
+from typing import Iterator, Optional, Tuple
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from src.utils.utils import CHUNK_SIZE
+
+MAX_FIELD_SIZE = 64 * 1024
+
+
+def _iter_events(stream, decoder: MultipartDecoder):
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            data = stream.read(CHUNK_SIZE)
+            # None tells the decoder the body has ended; a truncated body
+            # raises ValueError from next_event().
+            decoder.receive_data(data or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def _iter_data(events) -> Iterator[bytes]:
+    for event in events:
+        if not isinstance(event, Data):
+            raise ValueError("Malformed multipart body")
+        if event.data:
+            yield event.data
+        if not event.more_data:
+            return
+
+
+def iter_multipart(stream, boundary: bytes) -> Iterator[Tuple[str, Optional[str], object]]:
+    # Parses a multipart/form-data body as it is read from ``stream`` instead
+    # of spooling it to memory or temp files first. Yields (name, None, value)
+    # for form fields and (name, filename, chunks) for files, where chunks
+    # yields the file data as it arrives. Parts come in body order, so fields
+    # sent before the files are known before the first file byte is read.
+    # Chunks a consumer does not read are skipped.
+    events = _iter_events(stream, MultipartDecoder(boundary))
+    for event in events:
+        if isinstance(event, Field):
+            value = bytearray()
+            for data in _iter_data(events):
+                value += data
+                if len(value) > MAX_FIELD_SIZE:
+                    raise ValueError(f"Form field too large: {event.name}")
+            yield event.name, None, value.decode("utf-8", "replace")
+        elif isinstance(event, File):
+            chunks = _iter_data(events)
+            yield event.name, event.filename, chunks
+            for _ in chunks:
+                pass
@@ -0,0 +1,224 @@
+import queue
+import threading
+import time
+
+from src.utils.utils import CHUNK_SIZE, readinto_exact
+
+STAGES = ("read", "crypto", "write")
+
+
+class PipelineStats:
+    def __init__(self):
+        self.wall = 0.0
+        self.busy = {stage: 0.0 for stage in STAGES}
+        self.bytes = {stage: 0 for stage in STAGES}
+
+    def merge(self, other: dict):
+        self.wall += other["wall"]
+        for stage in STAGES:
+            self.busy[stage] += other["stages"][stage]["busy"]
+            self.bytes[stage] += other["stages"][stage]["bytes"]
+
+    def utilization(self, stage: str) -> float:
+        return min(1.0, self.busy[stage] / self.wall) if self.wall else 0.0
+
+    def bottleneck(self) -> str:
+        return max(STAGES, key=lambda stage: self.busy[stage])
+
+    def as_dict(self) -> dict:
+        return {
+            "wall": self.wall,
+            "bottleneck": self.bottleneck(),
+            "stages": {
+                stage: {"busy": self.busy[stage], "bytes": self.bytes[stage], "utilization": self.utilization(stage)}
+                for stage in STAGES
+            },
+        }
+
+    def summary(self) -> str:
+        parts = [f"{stage} {self.utilization(stage):.0%}" for stage in STAGES]
+        return f"Pipeline utilization: {', '.join(parts)} (bottleneck: {self.bottleneck()})"
+
+
+class BufferPool:
+    def __init__(self, count: int, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def acquire(self, timeout=None) -> bytearray:
+        return self._free.get(timeout=timeout)
+
+    def release(self, buffer: bytearray):
+        self._free.put(buffer)
+
+
+class PrefetchReader:
+    # Reader stage: a thread fills pooled buffers from ``src`` ahead of the
+    # consumer, which sees an ordinary readinto/read interface.
+    def __init__(self, src, stats: PipelineStats, depth: int, buffer_size: int = CHUNK_SIZE):
+        self._src = src
+        self._stats = stats
+        self._pool = BufferPool(depth + 1, buffer_size)
+        self._queue = queue.Queue(maxsize=depth)
+        self._closed = False
+        self._current = None
+        self._current_length = 0
+        self._offset = 0
+        self._eof = False
+        self.wait = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._closed:
+                buffer = self._pool.acquire()
+                started = time.perf_counter()
+                n = readinto_exact(self._src, buffer)
+                self._stats.busy["read"] += time.perf_counter() - started
+                self._stats.bytes["read"] += n
+                self._queue.put((buffer, n, None))
+                if n < len(buffer):
+                    return
+        except Exception as e:
+            self._queue.put((None, 0, e))
+
+    def _next_buffer(self) -> bool:
+        if self._current is not None:
+            self._pool.release(self._current)
+            self._current = None
+        if self._eof:
+            return False
+
+        started = time.perf_counter()
+        buffer, n, error = self._queue.get()
+        self.wait += time.perf_counter() - started
+        if error is not None:
+            self._eof = True
+            raise error
+        if n < self._pool.size:
+            self._eof = True
+        self._current, self._current_length, self._offset = buffer, n, 0
+        return n > 0
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        if self._current is None or self._offset >= self._current_length:
+            if not self._next_buffer():
+                return 0
+        n = min(len(view), self._current_length - self._offset)
+        view[:n] = memoryview(self._current)[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while size < 0 or size > 0:
+            buffer = bytearray(CHUNK_SIZE if size < 0 else size)
+            n = self.readinto(buffer)
+            if not n:
+                break
+            chunks.append(bytes(buffer[:n]))
+            if size > 0:
+                size -= n
+        return b"".join(chunks)
+
+    def close(self):
+        self._closed = True
+        while self._thread.is_alive():
+            try:
+                buffer, _, _ = self._queue.get(timeout=0.05)
+                if buffer is not None:
+                    self._pool.release(buffer)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+
+class WriteBehind:
+    # Writer stage: data is copied into pooled buffers and written to ``dst``
+    # by a thread, so the caller can go on encrypting the next chunk.
+    def __init__(self, dst, stats: PipelineStats, depth: int, buffer_size: int = CHUNK_SIZE):
+        self._dst = dst
+        self._stats = stats
+        self._pool = BufferPool(depth + 1, buffer_size)
+        self._queue = queue.Queue()
+        self._error = None
+        self.wait = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            buffer, n = item
+            if self._error is None:
+                try:
+                    started = time.perf_counter()
+                    self._dst.write(memoryview(buffer)[:n])
+                    self._stats.busy["write"] += time.perf_counter() - started
+                    self._stats.bytes["write"] += n
+                except Exception as e:
+                    self._error = e
+            self._pool.release(buffer)
+
+    def write(self, data) -> int:
+        if self._error is not None:
+            raise self._error
+        view = memoryview(data).cast("B")
+        for start in range(0, len(view), self._pool.size):
+            piece = view[start:start + self._pool.size]
+            started = time.perf_counter()
+            buffer = self._pool.acquire()
+            self.wait += time.perf_counter() - started
+            buffer[:len(piece)] = piece
+            self._queue.put((buffer, len(piece)))
+        return len(view)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class Pipeline:
+    # Wraps a source and destination file in reader and writer stages; the
+    # code running inside the ``with`` block is the crypto stage. A depth of
+    # 0 disables the threads and hands back the original files.
+    def __init__(self, src, dst, depth: int = 0, buffer_size: int = CHUNK_SIZE):
+        self.stats = PipelineStats()
+        self._depth = depth
+        self._buffer_size = buffer_size
+        self.reader = src
+        self.writer = dst
+        self._src = src
+        self._dst = dst
+        self._started = 0.0
+
+    def __enter__(self):
+        if self._depth > 0:
+            self.reader = PrefetchReader(self._src, self.stats, self._depth, self._buffer_size)
+            self.writer = WriteBehind(self._dst, self.stats, self._depth, self._buffer_size)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._depth <= 0:
+            return False
+        try:
+            self.writer.close()
+        except Exception:
+            if exc_type is None:
+                raise
+        finally:
+            self.reader.close()
+            self.stats.wall = time.perf_counter() - self._started
+            waits = self.reader.wait + self.writer.wait
+            self.stats.busy["crypto"] = max(0.0, self.stats.wall - waits)
+            self.stats.bytes["crypto"] = self.stats.bytes["read"]
+        return False
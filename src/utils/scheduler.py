@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, CancelledError, Future, ProcessPoolExecutor
+from typing import Callable, Optional
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+
+class WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, wait: float):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "avg": self.total / self.count if self.count else 0.0, "max": self.max}
+
+
+class FairScheduler:
+    # Shared pool for the CPU-heavy work items (per-file crypto tasks) of all
+    # sessions. At most ``max_concurrency`` items run at once. Waiting items
+    # are queued per session and dispatched round-robin, ``weight`` items per
+    # session and turn, and interactive items always go before bulk ones, so
+    # one session's large job cannot starve the others.
+    def __init__(self, max_concurrency: int, executor_factory: Optional[Callable] = None):
+        self.max_concurrency = max_concurrency
+        self._executor_factory = executor_factory or (lambda: ProcessPoolExecutor(max_workers=max_concurrency))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._weights = {}
+        self._credits = {}
+        self._running = 0
+        self._waits = {priority: WaitStats() for priority in PRIORITIES}
+
+    def lane(self, session_id: str, priority: str = BULK, weight: int = 1) -> "SchedulerLane":
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        return SchedulerLane(self, session_id, priority, max(1, weight))
+
+    def submit(self, session_id: str, priority: str, weight: int, func: Callable, *args) -> Future:
+        future = Future()
+        with self._lock:
+            self._queues[priority].setdefault(session_id, deque()).append((future, func, args, time.monotonic()))
+            self._weights[(priority, session_id)] = weight
+        self._dispatch()
+        return future
+
+    def _next_item(self) -> Optional[tuple]:
+        # The session at the front of the highest non-empty priority class
+        # gets the next slot; it moves to the back once its turn is used up.
+        for priority in PRIORITIES:
+            queues = self._queues[priority]
+            while queues:
+                session_id, queue = next(iter(queues.items()))
+                key = (priority, session_id)
+                item = queue.popleft()
+                credits = self._credits.get(key, self._weights.get(key, 1)) - 1
+                if not queue:
+                    del queues[session_id]
+                    self._credits.pop(key, None)
+                    self._weights.pop(key, None)
+                elif credits <= 0:
+                    queues.move_to_end(session_id)
+                    self._credits.pop(key, None)
+                else:
+                    self._credits[key] = credits
+
+                # Items whose future was cancelled while queued are dropped.
+                if item[0].set_running_or_notify_cancel():
+                    self._waits[priority].add(time.monotonic() - item[3])
+                    return item
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if self._running >= self.max_concurrency:
+                    return
+                item = self._next_item()
+                if item is None:
+                    return
+                self._running += 1
+                if self._executor is None:
+                    self._executor = self._executor_factory()
+                executor = self._executor
+
+            future, func, args, _ = item
+            try:
+                inner = executor.submit(func, *args)
+            except Exception as e:
+                self._complete(future, executor, error=e)
+                continue
+            inner.add_done_callback(lambda inner, future=future, executor=executor: self._complete(
+                future, executor, inner=inner
+            ))
+
+    def _complete(self, future: Future, executor, inner: Optional[Future] = None, error: Optional[Exception] = None):
+        # The slot is released whatever happened to the item, or the
+        # scheduler would slowly lose capacity.
+        try:
+            if inner is not None and inner.cancelled():
+                # E.g. the pool was shut down with the item still queued in it.
+                future.set_exception(CancelledError())
+                return
+            if inner is not None:
+                error = inner.exception()
+            if isinstance(error, BrokenExecutor):
+                # A crashed worker breaks the whole process pool; start a new
+                # one for the items that are still queued.
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(inner.result())
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._dispatch()
+
+    def metrics(self, session_id: Optional[str] = None) -> dict:
+        with self._lock:
+            metrics = {
+                "max_concurrency": self.max_concurrency,
+                "running": self._running,
+                "queued": {priority: sum(len(queue) for queue in self._queues[priority].values())
+                           for priority in PRIORITIES},
+                "waiting_sessions": {priority: len(self._queues[priority]) for priority in PRIORITIES},
+                "wait": {priority: self._waits[priority].as_dict() for priority in PRIORITIES},
+            }
+            if session_id is not None:
+                metrics["session_queued"] = {priority: len(self._queues[priority].get(session_id, ()))
+                                             for priority in PRIORITIES}
+        return metrics
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class SchedulerLane:
+    # Executor-like view of the scheduler for one session and priority; it
+    # can be passed wherever ``run_tasks`` accepts an executor.
+    def __init__(self, scheduler: FairScheduler, session_id: str, priority: str, weight: int):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.priority = priority
+        self.weight = weight
+
+    def submit(self, func: Callable, *args) -> Future:
+        return self.scheduler.submit(self.session_id, self.priority, self.weight, func, *args)
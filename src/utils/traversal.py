@@ -0,0 +1,44 @@
+import os
+from typing import Callable, Iterator, NamedTuple, Optional
+
+
+class ScanItem(NamedTuple):
+    rel_dir: str
+    rel_path: str
+    entry: os.DirEntry
+
+
+def scan_tree(root: str, on_error: Optional[Callable] = None, rel_dir: str = "") -> Iterator[ScanItem]:
+    # Single-pass, depth-first walk built on os.scandir. Every file and
+    # directory is yielded once, directories before their contents, with
+    # relative paths using "/". DirEntry caches its type (usually from the
+    # directory listing itself) and its stat() result, so callers learn what
+    # an entry is without a syscall and its size/mtime with at most one.
+    path = os.path.join(root, *rel_dir.split("/")) if rel_dir else root
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as e:
+        if on_error is None:
+            raise
+        on_error(e)
+        return
+
+    for entry in entries:
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        yield ScanItem(rel_dir, rel_path, entry)
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            yield from scan_tree(root, on_error, rel_path)
+
+
+def scan_files(root: str, on_error: Optional[Callable] = None) -> Iterator[ScanItem]:
+    for item in scan_tree(root, on_error):
+        try:
+            if item.entry.is_file():
+                yield item
+        except OSError:
+            continue
@@ -1,20 +1,248 @@
+import fnmatch
+import hashlib
+import hmac
+import json
 import os
 import shutil
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from threading import Lock
+from typing import Optional
 
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap, aes_key_unwrap, aes_key_wrap
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from datetime import datetime
 
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 16
+MAX_NAME_LENGTH = 65535
+NAME_HEADER_PEEK = 2 + 4096
+PBKDF2_ITERATIONS = 100_000
+FILE_KEY_INFO = b"file-encryption file key v2"
+KDF_ALGORITHM = "pbkdf2-sha3-512"
+WRAP_KEY_INFO = b"file-encryption key wrap v1"
+DATA_KEY_SIZE = 32
+METADATA_INFO = b"file-encryption metadata v1"
+METADATA_NONCE_SIZE = 12
+KEY_CHECK_INFO = b"file-encryption key check"
+KEY_CHECK_SIZE = 16
+PARALLEL_FILE_THRESHOLD = 64 * 1024 * 1024
+PARALLEL_RANGE_CHUNKS = 256
+HAS_PWRITE = hasattr(os, "pwrite")
+HAS_WRITEV = hasattr(os, "writev")
+GATHER_SIZE = 16 * 1024
+MANIFEST_SUFFIX = ".manifest"
+MANIFEST_VERSION = 2
+
+
+class OperationCancelledError(Exception):
+    pass
+
+
+def is_cancelled(cancel_event) -> bool:
+    return cancel_event is not None and cancel_event.is_set()
+
+
+class KeyCache:
+    # Bounded LRU of derived keys. Passwords are only kept as an HMAC under a
+    # per-cache secret, and evicted keys are overwritten before being dropped.
+    def __init__(self, max_entries: int = 256, ttl: float = 900.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def make_key(self, password: bytes, salt: bytes, iterations: int, algorithm: str = KDF_ALGORITHM) -> tuple:
+        digest = hmac.new(self._secret, password, hashlib.sha256).digest()
+        return digest, bytes(salt), iterations, algorithm
+
+    def get(self, cache_key: tuple) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._evict(cache_key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return bytes(entry[0])
+
+    def put(self, cache_key: tuple, key: bytes):
+        with self._lock:
+            if cache_key in self._entries:
+                self._evict(cache_key)
+            self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl)
+            self._evict_expired()
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def purge_expired(self):
+        # For callers that purge periodically, so expired keys do not stay in
+        # memory until the cache is used again.
+        with self._lock:
+            self._evict_expired()
+
+    def clear(self):
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._evict(cache_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for expired in [k for k, (_, expires) in self._entries.items() if expires < now]:
+            self._evict(expired)
+
+    def _evict(self, cache_key: tuple):
+        key, _ = self._entries.pop(cache_key)
+        key[:] = bytes(len(key))
+
+
+def derive_key(password: bytes, salt: bytes, iterations: int = PBKDF2_ITERATIONS,
+               cache: Optional[KeyCache] = None) -> bytes:
+    if cache is not None:
+        cache_key = cache.make_key(password, salt, iterations)
+        key = cache.get(cache_key)
+        if key is not None:
+            return key
 
-def derive_key(password: bytes, salt: bytes) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA3_512(),
         length=32,
         salt=salt,
-        iterations=100_000,
+        iterations=iterations,
     )
-    return kdf.derive(password)
+    key = kdf.derive(password)
+
+    if cache is not None:
+        cache.put(cache_key, key)
+    return key
+
+
+def derive_file_key(master_key: bytes, nonce: bytes) -> bytes:
+    # Cheap per-file subkey from a master key that was stretched once per batch.
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=nonce,
+        info=FILE_KEY_INFO,
+    )
+    return hkdf.derive(master_key)
+
+
+def _derive_wrap_key(master_key: bytes, nonce: bytes) -> bytes:
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=nonce,
+        info=WRAP_KEY_INFO,
+    )
+    return hkdf.derive(master_key)
+
+
+# Envelope encryption: file data is encrypted under a random data key, and
+# only the wrapped copy of that key in the header depends on the password.
+def wrap_file_key(master_key: bytes, nonce: bytes, data_key: bytes) -> bytes:
+    return aes_key_wrap(_derive_wrap_key(master_key, nonce), data_key)
+
+
+def unwrap_file_key(master_key: bytes, nonce: bytes, wrapped_key: bytes) -> Optional[bytes]:
+    try:
+        return aes_key_unwrap(_derive_wrap_key(master_key, nonce), wrapped_key)
+    except InvalidUnwrap:
+        return None
+
+
+def _derive_metadata_key(key: bytes) -> bytes:
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=METADATA_INFO,
+    )
+    return hkdf.derive(key)
+
+
+# File metadata (original name, size, mtime) is sealed under a subkey of the
+# file key and stored in the header, so it can be read without the payload.
+def seal_metadata(key: bytes, metadata: dict) -> bytes:
+    nonce = os.urandom(METADATA_NONCE_SIZE)
+    data = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+    return nonce + AESGCM(_derive_metadata_key(key)).encrypt(nonce, data, None)
+
+
+def open_metadata(key: bytes, sealed: bytes) -> Optional[dict]:
+    nonce, ciphertext = sealed[:METADATA_NONCE_SIZE], sealed[METADATA_NONCE_SIZE:]
+    try:
+        metadata = json.loads(AESGCM(_derive_metadata_key(key)).decrypt(nonce, ciphertext, None).decode("utf-8"))
+    except (InvalidTag, ValueError):
+        return None
+    return metadata if isinstance(metadata, dict) else None
+
+
+def run_tasks(func, tasks, workers: int = 1, executor=None):
+    # Yields (task, result, error) for every argument tuple in ``tasks``.
+    # With more than one worker the tasks run in a process pool and results
+    # arrive in completion order; at most a few tasks per worker are in flight.
+    # A shared ``executor`` (e.g. a scheduler lane) is used instead of a pool
+    # of our own when given; it is left running and only our queued tasks
+    # are cancelled when the caller stops early.
+    if executor is None and workers <= 1:
+        for task in tasks:
+            try:
+                yield task, func(*task), None
+            except Exception as e:
+                yield task, None, e
+        return
+
+    pool = executor or ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        task_iter = iter(tasks)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 4:
+                try:
+                    task = next(task_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(func, *task)] = task
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                error = future.exception()
+                yield task, None if error else future.result(), error
+    finally:
+        if executor is None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
+
+
+def compute_key_check(key: bytes) -> bytes:
+    return hmac.new(key, KEY_CHECK_INFO, hashlib.sha256).digest()[:KEY_CHECK_SIZE]
+
+
+def verify_key_check(key: bytes, key_check: bytes) -> bool:
+    return hmac.compare_digest(compute_key_check(key), key_check)
 
 
 def create_upload_directory(sessionID: str):
@@ -62,44 +290,264 @@ def delete_file(file_path):
     os.remove(file_path)
 
 
+def format_timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y%m%d_%H%M%S")
+
+
 def format_timestamp_from_path(path: str) -> str:
     try:
         ts = os.path.getctime(path)
     except Exception:
         ts = datetime.now().timestamp()
-    return datetime.fromtimestamp(ts).strftime("%Y%m%d_%H%M%S")
+    return format_timestamp(ts)
 
 
-def get_unique_output_path(output_dir: str, base_name: str, ext: str) -> str:
-    candidate = os.path.join(output_dir, base_name + ext)
-    counter = 1
-    while os.path.exists(candidate):
-        candidate = os.path.join(output_dir, f"{base_name}_{counter}{ext}")
-        counter += 1
-    return candidate
+class NameRegistry:
+    # Hands out unique "<base>_<n><ext>" names per output directory in O(1).
+    # Each directory is listed once; afterwards names come from an in-memory
+    # set and a per-base counter instead of exists() probes, and O_EXCL
+    # creation in claim() catches names taken by other processes. Names are
+    # claimed in the process that owns the registry; pool workers write temp
+    # files and hand them back instead of receiving the registry.
+    def __init__(self):
+        self._directories = {}
+        self._lock = Lock()
 
+    def _directory(self, output_dir: str) -> tuple:
+        key = os.path.abspath(output_dir)
+        state = self._directories.get(key)
+        if state is None:
+            try:
+                taken = set(os.listdir(output_dir))
+            except FileNotFoundError:
+                taken = set()
+            state = self._directories[key] = (taken, {})
+        return state
 
-def extract_name_and_data_from_payload(payload: bytes):
-    if len(payload) >= 2:
-        name_len = int.from_bytes(payload[:2], "big")
-        if 0 < name_len <= 4096 and len(payload) >= 2 + name_len:
-            name_bytes = payload[2:2 + name_len]
-            rest = payload[2 + name_len:]
+    def reserve(self, output_dir: str, base_name: str, ext: str) -> str:
+        with self._lock:
+            taken, counters = self._directory(output_dir)
+            counter = counters.get((base_name, ext), 0)
+            name = f"{base_name}_{counter}{ext}" if counter else base_name + ext
+            while name in taken:
+                counter += 1
+                name = f"{base_name}_{counter}{ext}"
+            taken.add(name)
+            counters[(base_name, ext)] = counter + 1
+        return os.path.join(output_dir, name)
+
+    def claim(self, output_dir: str, base_name: str, ext: str) -> str:
+        # Reserves a name and creates it as an empty placeholder; callers
+        # replace the placeholder with the finished file.
+        while True:
+            path = self.reserve(output_dir, base_name, ext)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                continue
+
+    def close(self):
+        with self._lock:
+            self._directories.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def readinto_exact(src, view) -> int:
+    # Like readinto, but only returns short at end of file.
+    view = memoryview(view)
+    total = 0
+    while total < len(view):
+        n = src.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def is_path_selected(rel_path: str, include: Optional[list] = None, exclude: Optional[list] = None) -> bool:
+    # Globs match the relative path with "/" separators or just its last
+    # component, with or without the .dat suffix; excludes win over includes
+    # and no includes selects all.
+    candidates = [rel_path, rel_path.rsplit("/", 1)[-1]]
+    if rel_path.lower().endswith(".dat"):
+        candidates += [candidate[:-4] for candidate in candidates]
+
+    def matches(patterns):
+        return any(fnmatch.fnmatch(candidate, pattern) for pattern in patterns for candidate in candidates)
+
+    if include and not matches(include):
+        return False
+    return not (exclude and matches(exclude))
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as src:
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def pwrite_all(fd: int, view, offset: int):
+    view = memoryview(view)
+    while len(view):
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+def preallocate(fd: int, size: int):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except AttributeError:
+        os.ftruncate(fd, size)
+    except OSError as e:
+        if e.errno == 28:
+            raise
+        os.ftruncate(fd, size)
+
+
+def buffer_size(length: int, limit: int = CHUNK_SIZE) -> int:
+    # Hot-loop buffers are sized to the data they will hold, so small files
+    # do not pay for allocating and zero-filling full chunk buffers.
+    return max(BLOCK_SIZE, min(limit, length))
+
+
+def write_all(fd: int, view):
+    view = memoryview(view)
+    while len(view):
+        view = view[os.write(fd, view):]
+
+
+def writev_all(fd: int, views: list):
+    views = [memoryview(view) for view in views if len(view)]
+    if not HAS_WRITEV:
+        for view in views:
+            write_all(fd, view)
+        return
+    while views:
+        n = os.writev(fd, views)
+        while views and n >= len(views[0]):
+            n -= len(views.pop(0))
+        if views:
+            views[0] = views[0][n:]
+
+
+class OutputFile:
+    # Unbuffered output file for the hot loops. Small writes (the container
+    # header, name prefixes, padding) are gathered in a fixed buffer and go
+    # out together with the next large write in a single os.writev call, so
+    # chunk-sized writes are never copied into an intermediate buffer and a
+    # small file costs one write syscall.
+    def __init__(self, path: str):
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        self._pending = bytearray(GATHER_SIZE)
+        self._filled = 0
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast("B")
+        n = len(view)
+        if self._filled + n <= len(self._pending):
+            self._pending[self._filled:self._filled + n] = view
+            self._filled += n
+        elif self._filled:
+            writev_all(self._fd, [memoryview(self._pending)[:self._filled], view])
+            self._filled = 0
+        else:
+            write_all(self._fd, view)
+        return n
+
+    def flush(self):
+        if self._filled:
+            write_all(self._fd, memoryview(self._pending)[:self._filled])
+            self._filled = 0
+
+    def close(self):
+        if self._fd < 0:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_name_header(name: str) -> bytes:
+    name_bytes = name.encode("utf-8")
+    if len(name_bytes) > MAX_NAME_LENGTH:
+        raise ValueError("Filename too long for encryption")
+    return len(name_bytes).to_bytes(2, "big") + name_bytes
+
+
+def _is_valid_embedded_name(name: str) -> bool:
+    return bool(name) and "\x00" not in name and not any(sep in name for sep in (os.sep, "/", "\\"))
+
+
+def split_name_header(head) -> tuple:
+    # ``head`` must be the whole payload or at least NAME_HEADER_PEEK bytes of it.
+    head = bytes(head[:NAME_HEADER_PEEK])
+    if len(head) >= 2:
+        name_len = int.from_bytes(head[:2], "big")
+        if 0 < name_len <= 4096 and len(head) >= 2 + name_len:
             try:
-                name = name_bytes.decode("utf-8")
-                if "\x00" not in name and not any(sep in name for sep in (os.sep, "/", "\\")):
-                    return name, rest
+                name = head[2:2 + name_len].decode("utf-8")
+                if _is_valid_embedded_name(name):
+                    return name, 2 + name_len
             except Exception:
                 pass
 
-    head = payload[:512]
-    if b"\n" in head:
+    if b"\n" in head[:512]:
         try:
-            name_part, rest = payload.split(b"\n", 1)
+            name_part = head.split(b"\n", 1)[0]
             name = name_part.decode("utf-8")
-            if name and "\x00" not in name and not any(sep in name for sep in (os.sep, "/", "\\")):
-                return name, rest
+            if _is_valid_embedded_name(name):
+                return name, len(name_part) + 1
         except Exception:
             pass
 
-    return None, payload
\ No newline at end of file
+    return None, 0
+
+
+def read_name_header(head) -> tuple:
+    # Strict counterpart of split_name_header for containers that flag an
+    # embedded name; returns (None, 0) if the header is malformed.
+    head = bytes(head[:2 + MAX_NAME_LENGTH])
+    if len(head) < 2:
+        return None, 0
+    name_len = int.from_bytes(head[:2], "big")
+    if len(head) < 2 + name_len:
+        return None, 0
+    try:
+        name = head[2:2 + name_len].decode("utf-8")
+    except UnicodeDecodeError:
+        return None, 0
+    if not _is_valid_embedded_name(name):
+        return None, 0
+    return name, 2 + name_len
+
+
+def extract_name_and_data_from_payload(payload: bytes):
+    name, offset = split_name_header(payload)
+    if name:
+        return name, payload[offset:]
+    return None, payload
@@ -0,0 +1,107 @@
+import time
+import zipfile
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from src.utils.utils import CHUNK_SIZE
+
+# ZIP timestamps cannot go back further than 1980.
+MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class _Sink:
+    # Write target for ZipFile that hands the written bytes to the generator
+    # instead of keeping them. It cannot seek, so ZipFile writes a data
+    # descriptor after each member rather than patching its local header.
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _iter_file(path: str):
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as src:
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                return
+            yield view[:n]
+
+
+def _iter_archive(entries, deflate: bool, on_progress: Optional[Callable]) -> Iterator[bytes]:
+    sink = _Sink()
+
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for info, size, chunks in entries:
+            if deflate and not info.filename.lower().endswith(".dat"):
+                info.compress_type = zipfile.ZIP_DEFLATED
+            else:
+                info.compress_type = zipfile.ZIP_STORED
+
+            # Without a known size ZIP64 fields are always written, since the
+            # member may turn out larger than 4 GiB.
+            with zf.open(info, "w", force_zip64=size is None) as dst:
+                for chunk in chunks:
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+                    if on_progress:
+                        on_progress(info.filename, len(chunk))
+            # The member trailer (data descriptor) is written on close.
+            data = sink.drain()
+            if data:
+                yield data
+
+    # Closing the archive wrote the central directory.
+    yield sink.drain()
+
+
+def iter_zip(files: Iterable[Tuple[str, str]], deflate: bool = False,
+             on_progress: Optional[Callable] = None) -> Iterator[bytes]:
+    # Yields a ZIP archive of ``files`` ((path, archive name) pairs) as it is
+    # produced, one chunk of input at a time, so memory use stays constant
+    # and the first bytes go out immediately. ZIP64 records are added where
+    # sizes or offsets need them. Encrypted .dat files are always stored;
+    # other files are deflated when ``deflate`` is set. ``on_progress`` is
+    # called with the archive name and the input bytes read after each chunk
+    # has been handed on.
+    def entries():
+        for path, arcname in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            yield info, info.file_size, _iter_file(path)
+
+    yield from _iter_archive(entries(), deflate, on_progress)
+
+
+def iter_zip_streams(streams: Iterable[Tuple[str, Optional[float], Optional[int], Iterable]], deflate: bool = False,
+                     on_progress: Optional[Callable] = None) -> Iterator[bytes]:
+    # Same as iter_zip for data produced on the fly, e.g. decrypted files:
+    # ``streams`` yields (archive name, mtime, size, chunks), where size is
+    # None when it is not known in advance.
+    def entries():
+        for arcname, mtime, size, chunks in streams:
+            date_time = time.localtime(mtime if mtime is not None else time.time())[:6]
+            info = zipfile.ZipInfo(arcname, max(date_time, MIN_DATE_TIME))
+            info.external_attr = 0o644 << 16
+            if size is not None:
+                info.file_size = size
+            yield info, size, chunks
+
+    yield from _iter_archive(entries(), deflate, on_progress)